@@ -24,6 +24,11 @@ from typing import Dict, List, Optional, Tuple
 
 from PIL import Image, UnidentifiedImageError
 
+try:
+    import orjson  # 可选：更快的 JSON 编解码
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
@@ -42,6 +47,20 @@ DEFAULT_PTY_ROWS = 40
 DEFAULT_PTY_COLS = 120
 
 
+def _json_loads(data):
+    """解析 JSON（str 或 bytes），优先使用 orjson；解析失败抛出 json.JSONDecodeError。"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """序列化为 UTF-8 JSON bytes，优先使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
 @dataclass
 class ChatState:
     current_session_id: Optional[str] = None
@@ -157,7 +176,7 @@ class CLIBridge:
                     if not line:
                         continue
                     try:
-                        item = json.loads(line)
+                        item = _json_loads(line)
                     except json.JSONDecodeError:
                         continue
                     session_id = item.get("session_id")
@@ -879,7 +898,7 @@ class CLIBridge:
 
     def _handle_event(self, job: JobState, line: str, state: ChatState):
         try:
-            event = json.loads(line)
+            event = _json_loads(line)
         except json.JSONDecodeError:
             job.raw_lines.append(line)
             return
@@ -1199,7 +1218,7 @@ class CLIBridge:
                 if not raw:
                     continue
                 try:
-                    entry = json.loads(raw)
+                    entry = _json_loads(raw)
                 except json.JSONDecodeError:
                     continue
 
@@ -1379,12 +1398,13 @@ class CLIBridge:
             "Content-Type": "application/json",
         }
         if body is not None:
-            data = json.dumps(body).encode("utf-8")
+            data = _json_dumps(body)
 
         request = urllib.request.Request(url, data=data, method=method, headers=headers)
         try:
             with urllib.request.urlopen(request, timeout=15) as response:
-                raw = response.read().decode("utf-8", errors="replace")
+                # 保持 bytes，直接交给 JSON 解析，省去一次 UTF-8 解码和中间 str
+                raw = response.read()
         except urllib.error.HTTPError as e:
             detail = e.read().decode("utf-8", errors="replace").strip()
             if e.code == 401:
@@ -1396,8 +1416,8 @@ class CLIBridge:
         if not raw.strip():
             return {}
         try:
-            return json.loads(raw)
-        except json.JSONDecodeError as e:
+            return _json_loads(raw)
+        except ValueError as e:  # JSONDecodeError，或 stdlib json 遇到非法 UTF-8 时的 UnicodeDecodeError
             raise RuntimeError(f"invalid cloud response: {e}")
 
     def _lookup_session_cwd(self, session_id: str) -> Optional[str]:
@@ -6,16 +6,30 @@ fuzzy image matching (confidence-based) for improved reliability.
 Compatible with Ubuntu 20.04 LTS (aarch64) and XFCE desktop environment.
 """
 
+import functools
+import io
 import logging
 import os
+import queue
+import select
 import shutil
 import subprocess
+import threading
 import time
-from typing import Callable, List, Optional, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
+import cv2
+import numpy as np
 import pyperclip
 from PIL import Image
 
+try:
+    import mss
+except ImportError:
+    mss = None
+
 # Lazy import for pyautogui — it connects to X11 on import,
 # which crashes if DISPLAY is invalid (e.g. stale SSH X11 forwarding)
 pyautogui = None
@@ -52,7 +66,7 @@ def _fix_display():
         return  # Current DISPLAY works fine
 
     logging.getLogger(__name__).warning(
-        f"DISPLAY={current!r} is not reachable, scanning for valid X11 display..."
+        "DISPLAY=%r is not reachable, scanning for valid X11 display...", current
     )
 
     # Build candidate list: X11 sockets first, then common fallbacks
@@ -69,29 +83,53 @@ def _fix_display():
         if _is_valid(candidate):
             os.environ['DISPLAY'] = candidate
             logging.getLogger(__name__).info(
-                f"Auto-fixed DISPLAY: {current!r} -> {candidate!r}"
+                "Auto-fixed DISPLAY: %r -> %r", current, candidate
             )
             return
 
     logging.getLogger(__name__).error(
-        f"No valid X11 display found (tried: {candidates}). GUI operations will fail."
+        "No valid X11 display found (tried: %s). GUI operations will fail.", candidates
     )
 
 
+# 调试信息里的 CWD / DISPLAY，在 _fix_display 之后缓存一次
+_ENV_INFO = ""
+
+
 def _ensure_pyautogui():
     """Lazily import pyautogui on first use, after validating DISPLAY."""
-    global pyautogui
+    global pyautogui, _ENV_INFO
     if pyautogui is None:
         _fix_display()
+        _ENV_INFO = f"CWD: {os.getcwd()}, DISPLAY: {os.getenv('DISPLAY', 'not set')}"
         import pyautogui as _pyautogui
         pyautogui = _pyautogui
         pyautogui.FAILSAFE = True
         pyautogui.PAUSE = 0.1
     return pyautogui
 
+
+@contextmanager
+def _no_pause():
+    """
+    临时关闭 pyautogui.PAUSE。
+
+    PAUSE=0.1 会在每次 pyautogui 调用后隐式 sleep 100ms；
+    程序化的按键序列里需要等待的地方都有显式 time.sleep，这部分隐式延迟纯属浪费。
+    """
+    _ensure_pyautogui()
+    old = pyautogui.PAUSE
+    pyautogui.PAUSE = 0
+    try:
+        yield
+    finally:
+        pyautogui.PAUSE = old
+
+
 # Configure logging
+# 默认 INFO，排查问题时可设置 AG_LOGLEVEL=DEBUG
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv('AG_LOGLEVEL', 'INFO').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -116,10 +154,10 @@ def backup_templates(templates_dir: str) -> bool:
             shutil.rmtree(_PERSISTENT_DIR_PATH)
         shutil.copytree(templates_dir, _PERSISTENT_DIR_PATH)
         _PERSISTENT_TEMPLATES_DIR = _PERSISTENT_DIR_PATH
-        logger.info(f"模板已备份到持久化目录: {_PERSISTENT_DIR_PATH}")
+        logger.info("模板已备份到持久化目录: %s", _PERSISTENT_DIR_PATH)
         return True
     except Exception as e:
-        logger.error(f"模板备份失败: {e}")
+        logger.error("模板备份失败: %s", e)
         return False
 
 
@@ -147,8 +185,8 @@ def _ensure_templates(templates_dir: str) -> str:
         persistent_file = os.path.join(_PERSISTENT_TEMPLATES_DIR, "input_box.png")
         if os.path.exists(persistent_file):
             logger.warning(
-                f"原始模板目录已损坏 ({templates_dir})，"
-                f"自动切换到持久化备份: {_PERSISTENT_TEMPLATES_DIR}"
+                "原始模板目录已损坏 (%s)，自动切换到持久化备份: %s",
+                templates_dir, _PERSISTENT_TEMPLATES_DIR
             )
             return _PERSISTENT_TEMPLATES_DIR
     
@@ -158,27 +196,781 @@ def _ensure_templates(templates_dir: str) -> str:
         if os.path.exists(persistent_file):
             _PERSISTENT_TEMPLATES_DIR = _PERSISTENT_DIR_PATH
             logger.warning(
-                f"原始模板目录已损坏 ({templates_dir})，"
-                f"发现之前的持久化备份: {_PERSISTENT_DIR_PATH}"
+                "原始模板目录已损坏 (%s)，发现之前的持久化备份: %s",
+                templates_dir, _PERSISTENT_DIR_PATH
             )
             return _PERSISTENT_DIR_PATH
     
     logger.error(
-        f"模板文件不可用: {critical_file}，且无持久化备份。"
-        f"模板操作将失败。"
+        "模板文件不可用: %s，且无持久化备份。模板操作将失败。", critical_file
     )
     return templates_dir
 
 
+# 进程内共用一个 mss 实例（持有一个 X 连接）：批处理每次都在新线程中运行，
+# 按线程创建的实例不会被关闭，会不断泄漏 X 客户端连接直到达到服务器上限
+_grabber = None
+_grabber_lock = threading.Lock()
+
+@dataclass
+class TemplateInfo:
+    """已解码的模板图像（BGR 与灰度各一份）。"""
+    path: str
+    bgr: np.ndarray
+    gray: np.ndarray
+    size: Tuple[int, int]  # (width, height)
+
+
+# 模板注册表: {绝对路径: TemplateInfo}，按目录一次性扫描填充
+_TEMPLATES: Dict[str, TemplateInfo] = {}
+_SCANNED_DIRS: set = set()
+
+
+def _scan_templates(templates_dir: str):
+    """
+    扫描目录下所有 PNG 模板并解码进注册表，每个目录只扫描一次。
+
+    模板在会话期间是静态的，扫描之后查找模板只是一次字典访问，
+    不再需要 os.path.exists / stat 和 PNG 解码。
+    """
+    templates_dir = os.path.abspath(templates_dir)
+    if templates_dir in _SCANNED_DIRS:
+        return
+    try:
+        entries = list(os.scandir(templates_dir))
+    except OSError as e:
+        logger.warning("_scan_templates: 无法扫描 %s: %s", templates_dir, e)
+        return
+    for entry in entries:
+        if not entry.name.lower().endswith('.png') or not entry.is_file():
+            continue
+        bgr = cv2.imread(entry.path, cv2.IMREAD_COLOR)
+        if bgr is None:
+            logger.warning("_scan_templates: 无法解码 %s", entry.path)
+            continue
+        _TEMPLATES[os.path.abspath(entry.path)] = TemplateInfo(
+            path=entry.path,
+            bgr=bgr,
+            gray=cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY),
+            size=(bgr.shape[1], bgr.shape[0]),
+        )
+    _SCANNED_DIRS.add(templates_dir)
+    logger.debug("_scan_templates: %s 共 %s 项", templates_dir, len(entries))
+
+
+def _get_template(image_path: str) -> Optional[TemplateInfo]:
+    """按路径查找模板（首次访问某目录时扫描该目录），不存在时返回 None。"""
+    image_path = os.path.abspath(image_path)
+    info = _TEMPLATES.get(image_path)
+    if info is None:
+        _scan_templates(os.path.dirname(image_path))
+        info = _TEMPLATES.get(image_path)
+    return info
+
+
+def _load_template(image_path: str, grayscale: bool = True) -> Optional[np.ndarray]:
+    """
+    读取模板图像（来自模板注册表）。
+
+    Args:
+        image_path: 模板图像路径
+        grayscale: True 返回单通道灰度模板，False 返回 BGR 模板
+
+    Returns:
+        模板 ndarray，文件不存在或无法解码时返回 None
+    """
+    info = _get_template(image_path)
+    if info is None:
+        return None
+    return info.gray if grayscale else info.bgr
+
+
+def _get_sct():
+    """返回进程共用的 mss 实例（首次调用时创建）；截图时须持有 _grabber_lock。"""
+    global _grabber
+    if _grabber is None:
+        with _grabber_lock:
+            if _grabber is None:
+                _grabber = mss.mss()
+    return _grabber
+
+
+# 屏幕尺寸缓存（会话期间分辨率基本不变）
+_SCREEN_SIZE: Optional[Tuple[int, int]] = None
+
+
+def _screen_size() -> Tuple[int, int]:
+    """返回整个 X screen 的 (width, height)，首次查询后缓存。"""
+    global _SCREEN_SIZE
+    if _SCREEN_SIZE is None:
+        if mss is None:
+            _ensure_pyautogui()
+            size = pyautogui.size()
+            _SCREEN_SIZE = (int(size[0]), int(size[1]))
+        else:
+            screen = _get_sct().monitors[0]
+            _SCREEN_SIZE = (screen['width'], screen['height'])
+    return _SCREEN_SIZE
+
+
+def _clip_region(
+    region: Tuple[int, int, int, int],
+    width: int,
+    height: int
+) -> Optional[Tuple[int, int, int, int]]:
+    """把搜索区域裁剪到 width x height 范围内，完全越界时返回 None。"""
+    x, y, w, h = (int(v) for v in region)
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + w, width), min(y + h, height)
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right - left, bottom - top)
+
+
+def _grab_screen(
+    region: Optional[Tuple[int, int, int, int]],
+    mss_code: int,
+    rgb_code: int
+) -> Optional[np.ndarray]:
+    """截取屏幕（或区域），用一次 cv2.cvtColor 转成目标颜色空间。"""
+    _ensure_pyautogui()
+    try:
+        if mss is None:
+            # 未安装 mss 时退回 pyautogui 截图（RGB）
+            return cv2.cvtColor(np.asarray(pyautogui.screenshot(region=region)), rgb_code)
+
+        sct = _get_sct()
+        if region:
+            x, y, w, h = region
+            monitor = {'left': x, 'top': y, 'width': w, 'height': h}
+        else:
+            monitor = sct.monitors[0]
+        with _grabber_lock:
+            shot = sct.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        return cv2.cvtColor(bgra, mss_code)
+    except Exception as e:
+        logger.warning("截图失败: %s", e)
+        return None
+
+
+def _screen_bgr(region: Optional[Tuple[int, int, int, int]] = None) -> Optional[np.ndarray]:
+    """
+    截取屏幕（或指定区域）为 BGR ndarray。
+
+    通过 mss 直接把帧读进内存，不经过 scrot 临时文件和 PNG 编解码。
+    全屏使用 monitors[0]（整个 X screen），坐标与 pyautogui / xdotool 一致。
+
+    Args:
+        region: 可选的截图区域 (x, y, width, height)，须已裁剪到屏幕范围内
+
+    Returns:
+        BGR 格式的屏幕图像，截图失败时返回 None
+    """
+    return _grab_screen(region, cv2.COLOR_BGRA2BGR, cv2.COLOR_RGB2BGR)
+
+
+def capture_screen_png() -> Optional[bytes]:
+    """
+    在进程内截取整个屏幕并编码为 PNG 字节（供 /screen 命令使用）。
+
+    复用模板匹配的 mss 截图实例，不需要启动 scrot 进程，也不落盘。
+
+    Returns:
+        PNG bytes，未安装 mss 或截图失败时返回 None（调用方可回退到 scrot）
+    """
+    if mss is None:
+        return None
+    frame = _screen_bgr()
+    if frame is None:
+        return None
+    ok, encoded = cv2.imencode('.png', frame)
+    return encoded.tobytes() if ok else None
+
+
+def _screen_gray(region: Optional[Tuple[int, int, int, int]] = None) -> Optional[np.ndarray]:
+    """
+    截取屏幕（或指定区域）为单通道灰度 ndarray。
+
+    UI 模板（输入框、Replying、Accept 等）用灰度匹配已足够，
+    相关运算的数据量只有 BGR 的 1/3。监控循环每轮只截一次屏，
+    再把同一帧交给多个查找调用复用。
+
+    Args:
+        region: 可选的截图区域 (x, y, width, height)，须已裁剪到屏幕范围内
+
+    Returns:
+        灰度屏幕图像，截图失败时返回 None
+    """
+    return _grab_screen(region, cv2.COLOR_BGRA2GRAY, cv2.COLOR_RGB2GRAY)
+
+
+# 图像金字塔匹配参数
+_PYRAMID_LEVELS = 3              # 最多向下采样 3 次（每层面积缩小 4 倍）
+_PYRAMID_MIN_TEMPLATE_SIDE = 12  # 最粗层模板最短边不小于 12px，否则减少层数
+_PYRAMID_CANDIDATE_RATIO = 0.9   # 粗层候选阈值 = confidence * 0.9
+_PYRAMID_MAX_CANDIDATES = 8      # 每层最多保留的候选数
+_PYRAMID_MARGIN = 4              # 细化窗口在模板四周额外留出的像素
+
+
+def _build_pyramid(img: np.ndarray, levels: int = _PYRAMID_LEVELS) -> List[np.ndarray]:
+    """构建高斯金字塔，pyramid[0] 为原图，之后每层边长减半。"""
+    pyramid = [img]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def _pyramid_levels(haystack: np.ndarray, needle: np.ndarray) -> int:
+    """根据模板和搜索图尺寸决定可用的金字塔层数（0 表示直接全分辨率匹配）。"""
+    levels = 0
+    needle_side = min(needle.shape[:2])
+    # 搜索图不比模板大多少时（例如已限定 region），金字塔没有收益
+    if haystack.shape[0] * haystack.shape[1] < 16 * needle.shape[0] * needle.shape[1]:
+        return 0
+    while levels < _PYRAMID_LEVELS and (needle_side >> (levels + 1)) >= _PYRAMID_MIN_TEMPLATE_SIDE:
+        levels += 1
+    return levels
+
+
+def _peak_candidates(res: np.ndarray, threshold: float) -> List[Tuple[int, int]]:
+    """取相关图中不低于阈值的局部极大值，按分数从高到低最多返回若干个 (x, y)。"""
+    peaks = (res >= threshold) & (res == cv2.dilate(res, np.ones((3, 3), np.uint8)))
+    ys, xs = np.nonzero(peaks)
+    if len(xs) == 0:
+        return []
+    order = np.argsort(res[ys, xs])[::-1][:_PYRAMID_MAX_CANDIDATES]
+    return [(int(xs[i]), int(ys[i])) for i in order]
+
+
+def _exact_score(area: np.ndarray, needle: np.ndarray) -> float:
+    """
+    计算两幅等大图像的归一化相关系数（与 TM_CCOEFF_NORMED 在单一位置的取值一致）。
+
+    只需一次 O(w·h) 的向量化运算，分数与 matchTemplate 可直接比较，共用同一套阈值。
+    """
+    a = area.astype(np.float32).ravel()
+    b = needle.astype(np.float32).ravel()
+    a -= a.mean()
+    b -= b.mean()
+    denom = float(np.sqrt(np.dot(a, a) * np.dot(b, b)))
+    if denom < 1e-6:
+        # 纯色区域无法计算相关，完全相同视为命中
+        return 1.0 if np.array_equal(area, needle) else 0.0
+    return float(np.dot(a, b)) / denom
+
+
+def _full_match(haystack: np.ndarray, needle: np.ndarray) -> Tuple[float, Tuple[int, int]]:
+    """原分辨率全图 matchTemplate，返回 (最高分数, 匹配中心坐标)。"""
+    res = cv2.matchTemplate(haystack, needle, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(res)
+    return float(max_val), (max_loc[0] + needle.shape[1] // 2, max_loc[1] + needle.shape[0] // 2)
+
+
+def _best_match(
+    haystack: np.ndarray,
+    needle: np.ndarray,
+    min_confidence: float = 0.0
+) -> Tuple[float, Optional[Tuple[int, int]]]:
+    """
+    计算模板在图像中的最佳匹配。
+
+    大图上使用高斯金字塔：先在最粗层定位候选，再逐层放大坐标，
+    只在候选附近 (模板 + 2 * margin) 的小窗口内重新匹配，直到原分辨率。
+    细化后的分数仍低于 min_confidence 时退回原分辨率全图匹配。
+    matchTemplate 代价为 O(W·H·w·h)，每降一层约减少 16 倍计算量。
+
+    相关图只与输入有关、与阈值无关，因此只算一次，
+    调用方可以用同一个分数判断任意不低于 min_confidence 的 confidence 级别。
+
+    Args:
+        haystack: 搜索图像
+        needle: 模板图像
+        min_confidence: 调用方会用到的最低阈值，用于筛选粗层候选
+
+    Returns:
+        (最高分数, 匹配中心坐标)，图像比模板小时返回 (-1.0, None)
+    """
+    needle_h, needle_w = needle.shape[:2]
+    if haystack.shape[0] < needle_h or haystack.shape[1] < needle_w:
+        return -1.0, None
+
+    if haystack.shape[:2] == needle.shape[:2]:
+        # 搜索区域与模板等大：只有一个位置，直接逐像素计算，无需相关图
+        return _exact_score(haystack, needle), (needle_w // 2, needle_h // 2)
+
+    levels = _pyramid_levels(haystack, needle)
+    if levels == 0:
+        return _full_match(haystack, needle)
+
+    hay_pyramid = _build_pyramid(haystack, levels)
+    needle_pyramid = _build_pyramid(needle, levels)
+
+    # 最粗层：全图匹配，筛选候选
+    res = cv2.matchTemplate(hay_pyramid[levels], needle_pyramid[levels], cv2.TM_CCOEFF_NORMED)
+    _, coarse_val, _, coarse_loc = cv2.minMaxLoc(res)
+    candidates = _peak_candidates(res, min_confidence * _PYRAMID_CANDIDATE_RATIO)
+    if not candidates:
+        # 粗层都达不到阈值，原分辨率也不会命中，直接返回粗层结果
+        scale = 1 << levels
+        return float(coarse_val), (coarse_loc[0] * scale + needle_w // 2, coarse_loc[1] * scale + needle_h // 2)
+
+    # 逐层细化：坐标放大 2 倍，只在候选周围的小窗口内重新匹配
+    scores: List[float] = []
+    for level in range(levels - 1, -1, -1):
+        hay = hay_pyramid[level]
+        tpl = needle_pyramid[level]
+        tpl_h, tpl_w = tpl.shape[:2]
+        refined = []
+        scores = []
+        for x, y in candidates:
+            left = max(x * 2 - _PYRAMID_MARGIN, 0)
+            top = max(y * 2 - _PYRAMID_MARGIN, 0)
+            right = min(x * 2 + tpl_w + _PYRAMID_MARGIN, hay.shape[1])
+            bottom = min(y * 2 + tpl_h + _PYRAMID_MARGIN, hay.shape[0])
+            window = hay[top:bottom, left:right]
+            if window.shape[0] < tpl_h or window.shape[1] < tpl_w:
+                continue
+            window_res = cv2.matchTemplate(window, tpl, cv2.TM_CCOEFF_NORMED)
+            _, val, _, loc = cv2.minMaxLoc(window_res)
+            refined.append((left + loc[0], top + loc[1]))
+            scores.append(float(val))
+        candidates = refined
+        if not candidates:
+            break
+
+    if not candidates or (min_confidence > 0 and max(scores) < min_confidence):
+        # 粗层有候选但细化后都达不到阈值：降采样可能让候选偏离真实位置，
+        # 退回一次原分辨率全图匹配，保证不比直接匹配漏检
+        return _full_match(haystack, needle)
+
+    best = int(np.argmax(scores))
+    x, y = candidates[best]
+    return scores[best], (x + needle_w // 2, y + needle_h // 2)
+
+
+def _match_any(
+    haystack: np.ndarray,
+    needles: List[np.ndarray],
+    min_confidence: float = 0.0
+) -> Tuple[int, float, Optional[Tuple[int, int]]]:
+    """
+    在同一幅图像中同时匹配多个模板，返回得分最高者。
+
+    各模板的相关图按模板中心对齐后用 np.maximum 叠到一张图上，
+    只需一次 cv2.minMaxLoc 即得到所有模板中的最佳位置。
+    需要走金字塔的大模板单独调用 _best_match。
+
+    Returns:
+        (模板下标, 最高分数, 匹配中心坐标)，均未能匹配时返回 (-1, -1.0, None)
+    """
+    best: Tuple[int, float, Optional[Tuple[int, int]]] = (-1, -1.0, None)
+    stacked = None
+    maps = []
+    for i, needle in enumerate(needles):
+        needle_h, needle_w = needle.shape[:2]
+        if haystack.shape[0] < needle_h or haystack.shape[1] < needle_w:
+            continue
+        if _pyramid_levels(haystack, needle) > 0:
+            score, center = _best_match(haystack, needle, min_confidence)
+            if center is not None and score > best[1]:
+                best = (i, score, center)
+            continue
+        res = cv2.matchTemplate(haystack, needle, cv2.TM_CCOEFF_NORMED)
+        if stacked is None:
+            stacked = np.full(haystack.shape[:2], -1.0, dtype=np.float32)
+        top, left = needle_h // 2, needle_w // 2
+        view = stacked[top:top + res.shape[0], left:left + res.shape[1]]
+        np.maximum(view, res, out=view)
+        maps.append((i, top, left, res))
+
+    if stacked is not None:
+        _, max_val, _, max_loc = cv2.minMaxLoc(stacked)
+        if max_val > best[1]:
+            cx, cy = max_loc
+            # 找出在该位置取得最高分的模板
+            for i, top, left, res in maps:
+                y, x = cy - top, cx - left
+                if 0 <= y < res.shape[0] and 0 <= x < res.shape[1] and res[y, x] >= max_val:
+                    best = (i, float(max_val), (cx, cy))
+                    break
+    return best
+
+
+def _search_area(
+    region: Optional[Tuple[int, int, int, int]] = None,
+    haystack: Optional[np.ndarray] = None,
+    grayscale: bool = True
+) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
+    """
+    取得要搜索的图像及其在屏幕上的原点。
+
+    传入 haystack（全屏帧）时直接在内存中裁剪 region，否则按 region 截图。
+
+    Returns:
+        (搜索图像, (原点 x, 原点 y))，区域越界或截图失败时图像为 None
+    """
+    if region:
+        if haystack is not None:
+            height, width = haystack.shape[:2]
+        else:
+            width, height = _screen_size()
+        region = _clip_region(region, width, height)
+        if region is None:
+            return None, (0, 0)
+    offset = (region[0], region[1]) if region else (0, 0)
+    if haystack is not None:
+        if region:
+            x, y, w, h = region
+            haystack = haystack[y:y + h, x:x + w]
+        return haystack, offset
+    if grayscale:
+        return _screen_gray(region), offset
+    return _screen_bgr(region), offset
+
+
+def _locate(
+    image_path: str,
+    confidence: float,
+    region: Optional[Tuple[int, int, int, int]] = None,
+    haystack: Optional[np.ndarray] = None,
+    grayscale: bool = True
+) -> Optional[Tuple[int, int]]:
+    """
+    在屏幕上查找模板，返回屏幕坐标系下的中心点或 None。
+
+    Args:
+        image_path: 模板图像路径
+        confidence: 匹配阈值
+        region: 可选的搜索区域 (x, y, width, height)
+        haystack: 可选的已截取全屏帧（_screen_gray / _screen_bgr），
+                  传入时不再重新截图，颜色空间以该帧为准
+        grayscale: 未传入 haystack 时，是否使用灰度匹配
+
+    Raises:
+        ValueError: 模板不存在或无法解码
+    """
+    if haystack is not None:
+        grayscale = haystack.ndim == 2
+    needle = _load_template(image_path, grayscale)
+    if needle is None:
+        raise ValueError(f"无法读取模板: {image_path}")
+
+    haystack, offset = _search_area(region, haystack, grayscale)
+    if haystack is None:
+        return None
+
+    score, center = _best_match(haystack, needle, confidence)
+    if center is None or score < confidence:
+        return None
+    return (offset[0] + center[0], offset[1] + center[1])
+
+
+# 最近一次命中位置: {template_key: (x, y, timestamp)}
+_last_location: Dict[str, Tuple[int, int, float]] = {}
+_LOCALITY_TTL = 60      # 命中记录有效期（秒）
+_LOCALITY_RADIUS = 200  # 在上次位置周围 ±200px 内搜索
+
+# 模板尺寸 (width, height)，用于在上次命中位置做等大区域的快速复检
+_template_sizes: Dict[str, Tuple[int, int]] = {}
+
+# 上一次查找未命中的模板：连续未命中时（目标多半不在屏幕上）跳过窗口区域，只做一次全屏匹配
+_locality_missed: set = set()
+
+# antigravity 窗口区域缓存: (region, timestamp)
+_window_region_cache: Tuple[Optional[Tuple[int, int, int, int]], float] = (None, 0.0)
+_WINDOW_REGION_TTL = 10
+_WINDOW_COVERAGE = 0.8  # 窗口面积达到屏幕的该比例时，窗口搜索与全屏搜索几乎等价
+
+
+def _locality_region(template_key: str) -> Optional[Tuple[int, int, int, int]]:
+    """若模板近期命中过，返回以上次位置为中心的搜索区域，否则返回 None。"""
+    hit = _last_location.get(template_key)
+    if not hit or time.time() - hit[2] > _LOCALITY_TTL:
+        return None
+    x, y, _ = hit
+    return (x - _LOCALITY_RADIUS, y - _LOCALITY_RADIUS, 2 * _LOCALITY_RADIUS, 2 * _LOCALITY_RADIUS)
+
+
+def _exact_region(template_key: str) -> Optional[Tuple[int, int, int, int]]:
+    """
+    返回与模板等大、以上次命中中心为中心的区域；无记录或尺寸未知时返回 None。
+
+    UI 元素没动时，这一步即可确认命中，不必在 ±200px 范围内计算相关图。
+    """
+    hit = _last_location.get(template_key)
+    size = _template_sizes.get(template_key)
+    if not hit or not size or time.time() - hit[2] > _LOCALITY_TTL:
+        return None
+    w, h = size
+    return (hit[0] - w // 2, hit[1] - h // 2, w, h)
+
+
+def _remember_location(template_key: str, location: Tuple[int, int]):
+    """记录模板的命中位置，供下次查找缩小搜索区域。"""
+    _last_location[template_key] = (int(location[0]), int(location[1]), time.time())
+
+
+def _window_covers_screen(window: Tuple[int, int, int, int]) -> bool:
+    """窗口是否覆盖了大部分屏幕（此时单独的窗口区域搜索没有收益）。"""
+    width, height = _screen_size()
+    return window[2] * window[3] >= _WINDOW_COVERAGE * width * height
+
+
+def _window_region(window_name_pattern: str = "antigravity") -> Optional[Tuple[int, int, int, int]]:
+    """
+    通过 xdotool getwindowgeometry 获取目标窗口区域 (x, y, width, height)。
+
+    结果缓存 10 秒，避免每次查找都启动 xdotool。
+    与 activate_window 一致，多个窗口匹配时取最后一个。获取失败返回 None（全屏搜索）。
+    """
+    global _window_region_cache
+    region, ts = _window_region_cache
+    if time.time() - ts < _WINDOW_REGION_TTL:
+        return region
+
+    region = None
+    try:
+        result = subprocess.run(
+            ['xdotool', 'search', '--onlyvisible', '--name', window_name_pattern,
+             'getwindowgeometry', '--shell', '%@'],
+            capture_output=True, text=True, timeout=2
+        )
+        if result.returncode == 0:
+            geometry = {}
+            for line in result.stdout.splitlines():
+                key, _, value = line.partition('=')
+                if key in ('X', 'Y', 'WIDTH', 'HEIGHT'):
+                    geometry[key] = int(value)
+            if len(geometry) == 4 and geometry['WIDTH'] > 0 and geometry['HEIGHT'] > 0:
+                region = (geometry['X'], geometry['Y'], geometry['WIDTH'], geometry['HEIGHT'])
+    except Exception as e:
+        logger.debug("_window_region: 获取窗口区域失败: %s", e)
+
+    _window_region_cache = (region, time.time())
+    return region
+
+
+# 窗口三级二分网格 (rows, cols)：粗 2x3 / 中 4x6 / 细 8x12
+_TILE_GRIDS = [(2, 3), (4, 6), (8, 12)]
+_TILE_DECAY = 0.8           # 每次命中时其他格子的分数衰减系数
+_TILE_PROBES = [1, 1, 2]    # 每一级最多优先搜索的格子数（粗 / 中 / 细）
+
+
+class _TileSaliency:
+    """
+    记录模板在 antigravity 窗口各网格中的历史命中分数。
+
+    Replying / Accept 总是出现在聊天界面的固定区域，
+    按命中分数从细到粗依次只搜索少数几个格子，命中即返回，
+    几次命中之后基本第一个格子就能找到，不必匹配整个窗口。
+    窗口几何变化时重新建立网格。
+    """
+
+    def __init__(self, window: Tuple[int, int, int, int]):
+        self.window = window
+        self.tiles = [self._grid(rows, cols) for rows, cols in _TILE_GRIDS]
+        self.scores = [np.zeros(len(tiles)) for tiles in self.tiles]
+
+    def _grid(self, rows: int, cols: int) -> List[Tuple[int, int, int, int]]:
+        x, y, w, h = self.window
+        xs = [x + w * c // cols for c in range(cols + 1)]
+        ys = [y + h * r // rows for r in range(rows + 1)]
+        return [
+            (xs[c], ys[r], xs[c + 1] - xs[c], ys[r + 1] - ys[r])
+            for r in range(rows) for c in range(cols)
+        ]
+
+    def candidates(self, pad: Tuple[int, int]) -> List[Tuple[int, int, int, int]]:
+        """
+        按 细 → 中 → 粗 的顺序返回有命中记录的格子（按分数从高到低）。
+
+        每个格子向外扩展 pad（模板宽高），保证跨格子边界的模板也能完整匹配。
+        """
+        pad_w, pad_h = pad
+        regions = []
+        for level in range(len(self.tiles) - 1, -1, -1):
+            scores = self.scores[level]
+            order = [int(i) for i in np.argsort(scores)[::-1] if scores[i] > 0]
+            for i in order[:_TILE_PROBES[level]]:
+                x, y, w, h = self.tiles[level][i]
+                regions.append((x - pad_w, y - pad_h, w + 2 * pad_w, h + 2 * pad_h))
+        return regions
+
+    def record(self, location: Tuple[int, int]):
+        """命中后提升所在格子的分数，其余格子衰减。"""
+        lx, ly = int(location[0]), int(location[1])
+        for level, tiles in enumerate(self.tiles):
+            self.scores[level] *= _TILE_DECAY
+            for i, (x, y, w, h) in enumerate(tiles):
+                if x <= lx < x + w and y <= ly < y + h:
+                    self.scores[level][i] += 1.0
+                    break
+
+
+_tile_saliency: Dict[str, _TileSaliency] = {}
+
+
+def _saliency_for(template_key: str, window: Tuple[int, int, int, int]) -> _TileSaliency:
+    """返回模板在当前窗口几何下的 _TileSaliency（窗口变化时重建）。"""
+    saliency = _tile_saliency.get(template_key)
+    if saliency is None or saliency.window != window:
+        saliency = _TileSaliency(window)
+        _tile_saliency[template_key] = saliency
+    return saliency
+
+
+def _with_locality(template_key: str):
+    """
+    装饰器：优先在模板上次命中位置附近搜索。
+
+    被装饰的函数须接受 region 关键字参数，并返回命中坐标 (x, y) 或 None。
+    输入框、Replying、Accept 在会话期间位置基本不变，
+    400x400 的区域比全屏少一个数量级的匹配计算。
+
+    - 60 秒内有命中记录且模板尺寸已知时，先在上次位置做等大区域复检
+    - 仍未命中时在 (x±200, y±200) 内查找
+    - 再依次搜索窗口网格中历史命中分数最高的几个格子（见 _TileSaliency），上一次未命中时跳过
+    - 未命中（或无记录）时回退到 antigravity 窗口区域，仍未命中时全屏搜索；
+      窗口覆盖大部分屏幕、获取不到窗口或上一次也未命中时直接全屏搜索，
+      使目标持续不在屏幕上时的代价与一次全屏匹配相当
+    - 命中后更新记录；调用方显式传入 region 时不做替换
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, region=None, **kwargs):
+            if region is not None:
+                location = func(*args, region=region, **kwargs)
+            else:
+                location = None
+                exact = _exact_region(template_key)
+                if exact:
+                    location = func(*args, region=exact, **kwargs)
+                hint = _locality_region(template_key) if location is None else None
+                if hint:
+                    location = func(*args, region=hint, **kwargs)
+                window = _window_region()
+                saliency = _saliency_for(template_key, window) if window else None
+                # 上一次也未命中时不逐格探测，避免持续缺席的目标在每轮都多搜一遍格子
+                if location is None and saliency and template_key not in _locality_missed:
+                    pad = _template_sizes.get(template_key, (0, 0))
+                    for tile in saliency.candidates(pad):
+                        location = func(*args, region=tile, **kwargs)
+                        if location is not None:
+                            break
+                search_window = (
+                    window is not None
+                    and template_key not in _locality_missed
+                    and not _window_covers_screen(window)
+                )
+                if location is None and search_window:
+                    location = func(*args, region=window, **kwargs)
+                if location is None:
+                    # 窗口几何缓存可能过期（窗口移动/缩放）或选错了窗口，最后全屏再找一次
+                    location = func(*args, region=None, **kwargs)
+                if location is not None and saliency:
+                    saliency.record(location)
+                if location is None:
+                    _locality_missed.add(template_key)
+                else:
+                    _locality_missed.discard(template_key)
+            if location is not None:
+                _remember_location(template_key, location)
+            return location
+        return wrapper
+    return decorator
+
+
+def _template_locator(template_name: str):
+    """为指定模板生成带位置缓存的查找函数 (templates_dir, confidence, region, haystack)。"""
+    template_key = os.path.splitext(template_name)[0]
+
+    @_with_locality(template_key)
+    def locate(
+        templates_dir: str,
+        confidence: float,
+        region: Optional[Tuple[int, int, int, int]] = None,
+        haystack: Optional[np.ndarray] = None
+    ) -> Optional[Tuple[int, int]]:
+        image_path = os.path.join(templates_dir, template_name)
+        info = _get_template(image_path)
+        if info is not None:
+            _template_sizes[template_key] = info.size
+        return _locate(image_path, confidence, region, haystack)
+    return locate
+
+
+_locate_input_box = _template_locator("input_box.png")
+_locate_replying = _template_locator("Replying.png")
+_ACCEPT_TEMPLATES = ["accept_button.png", "accept_all.png"]
+
+
+@_with_locality("accept")
+def _locate_accept(
+    templates_dir: str,
+    confidence: float,
+    region: Optional[Tuple[int, int, int, int]] = None,
+    haystack: Optional[np.ndarray] = None
+) -> Optional[Tuple[int, int, str]]:
+    """
+    一次性匹配 accept_button / accept_all，返回 (x, y, 模板名) 或 None。
+
+    两个按钮出现在同一位置，共用一条位置缓存。
+    """
+    templates = [(name, _get_template(os.path.join(templates_dir, name))) for name in _ACCEPT_TEMPLATES]
+    templates = [(name, info) for name, info in templates if info is not None]
+    if not templates:
+        return None
+    # 共用位置缓存按最大的模板记录尺寸，能容纳任一按钮
+    _template_sizes["accept"] = (
+        max(info.size[0] for _, info in templates),
+        max(info.size[1] for _, info in templates),
+    )
+    area, offset = _search_area(region, haystack, haystack is None or haystack.ndim == 2)
+    if area is None:
+        return None
+    needles = [info.gray if area.ndim == 2 else info.bgr for _, info in templates]
+    index, score, center = _match_any(area, needles, confidence)
+    if center is None or score < confidence:
+        return None
+    return (offset[0] + center[0], offset[1] + center[1], templates[index][0])
+
+
 # Default confidence levels to try (from high to low)
 DEFAULT_CONFIDENCE_LEVELS = [0.8, 0.7, 0.6, 0.5, 0.4, 0.3]
 
 
+def warm_up(templates_dir: Optional[str] = None):
+    """
+    预热 GUI 自动化依赖，建议在程序启动时于后台线程调用。
+
+    把一次性的初始化开销（DISPLAY 校验与 pyautogui 导入、X 连接、
+    OpenCV 首次 matchTemplate、模板解码）挪到启动阶段，不落在第一条消息上。
+    mss 实例进程内共用，这里创建的 X 连接之后所有线程都会复用。
+
+    Args:
+        templates_dir: 可选的模板目录，传入时预先解码其中所有 PNG 模板
+    """
+    start = time.time()
+    try:
+        _ensure_pyautogui()
+        _screen_size()
+        frame = _screen_gray((0, 0, 64, 64))
+        if frame is not None:
+            cv2.matchTemplate(frame, frame[:16, :16].copy(), cv2.TM_CCOEFF_NORMED)
+        if templates_dir:
+            _scan_templates(_ensure_templates(templates_dir))
+        logger.info("warm_up: 完成 (%.2fs)", time.time() - start)
+    except Exception as e:
+        logger.warning("warm_up 失败: %s", e)
+
+
 def smart_find_image(
     image_path: str,
     confidence_levels: list = None,
     region: tuple = None,
-    save_screenshot: bool = False
+    save_screenshot: bool = False,
+    grayscale: bool = True
 ) -> dict:
     """
     智能查找图像模板 - 公共工具函数
@@ -191,6 +983,7 @@ def smart_find_image(
         confidence_levels: 要尝试的 confidence 级别列表，默认 [0.8, 0.7, 0.6, 0.5, 0.4, 0.3]
         region: 可选的搜索区域 (x, y, width, height)
         save_screenshot: 是否保存当前屏幕截图用于调试
+        grayscale: 是否使用灰度（单通道）匹配，默认 True
     
     Returns:
         dict: {
@@ -220,29 +1013,23 @@ def smart_find_image(
         'screenshot_path': None,
     }
     
-    # 检查文件是否存在
-    if not os.path.exists(image_path):
+    # 检查模板是否存在
+    template = _get_template(image_path)
+    if template is None:
         result['debug_info'] = f"模板文件不存在: {image_path}"
         logger.error(result['debug_info'])
         return result
     
-    # 收集调试信息
+    # 收集调试信息（环境/尺寸信息仅在 DEBUG 级别收集）
     debug_parts = []
-    debug_parts.append(f"CWD: {os.getcwd()}")
-    debug_parts.append(f"DISPLAY: {os.getenv('DISPLAY', 'not set')}")
-    
-    try:
-        screen_w, screen_h = pyautogui.size()
-        debug_parts.append(f"屏幕: {screen_w}x{screen_h}")
-    except Exception as e:
-        debug_parts.append(f"获取屏幕尺寸失败: {e}")
-    
-    try:
-        from PIL import Image as PILImage
-        img = PILImage.open(image_path)
-        debug_parts.append(f"模板: {img.size[0]}x{img.size[1]}")
-    except Exception as e:
-        debug_parts.append(f"读取模板失败: {e}")
+    if logger.isEnabledFor(logging.DEBUG):
+        debug_parts.append(_ENV_INFO)
+        try:
+            screen_w, screen_h = _screen_size()
+            debug_parts.append(f"屏幕: {screen_w}x{screen_h}")
+        except Exception as e:
+            debug_parts.append(f"获取屏幕尺寸失败: {e}")
+        debug_parts.append(f"模板: {template.size[0]}x{template.size[1]}")
     
     # 保存截图用于调试
     if save_screenshot:
@@ -255,32 +1042,31 @@ def smart_find_image(
         except Exception as e:
             debug_parts.append(f"截图失败: {e}")
     
-    # 尝试不同的 confidence 级别
+    # 相关图只计算一次，再用同一个最高分依次判断各个 confidence 级别
     tried_levels = []
-    for conf in confidence_levels:
-        try:
-            location = pyautogui.locateCenterOnScreen(
-                image_path,
-                confidence=conf,
-                region=region
-            )
-            if location:
+    needle = template.gray if grayscale else template.bgr
+    haystack, offset = _search_area(region, grayscale=grayscale)
+    if haystack is None:
+        tried_levels = [f"{conf}:错误(截图失败)" for conf in confidence_levels]
+    else:
+        score, center = _best_match(haystack, needle, min(confidence_levels))
+        debug_parts.append(f"最高匹配分: {score:.3f}")
+        # 从高到低判断，命中的第一个级别即为该分数能满足的最高 confidence
+        for conf in sorted(confidence_levels, reverse=True):
+            if center is not None and score >= conf:
+                x, y = offset[0] + center[0], offset[1] + center[1]
                 result['found'] = True
-                result['location'] = (location.x, location.y)
+                result['location'] = (x, y)
                 result['confidence'] = conf
-                debug_parts.append(f"成功! confidence={conf}, 位置=({location.x}, {location.y})")
-                logger.info(f"smart_find_image: 找到 {image_path} @ ({location.x}, {location.y}), confidence={conf}")
+                debug_parts.append(f"成功! confidence={conf}, 位置=({x}, {y})")
+                logger.info("smart_find_image: 找到 %s @ (%d, %d), confidence=%s, score=%.3f", image_path, x, y, conf, score)
                 break
             else:
                 tried_levels.append(f"{conf}:未找到")
-        except pyautogui.ImageNotFoundException:
-            tried_levels.append(f"{conf}:未找到")
-        except Exception as e:
-            tried_levels.append(f"{conf}:错误({e})")
     
     if not result['found']:
         debug_parts.append(f"尝试的 confidence 级别: {', '.join(tried_levels)}")
-        logger.warning(f"smart_find_image: 未找到 {image_path}, 尝试了: {tried_levels}")
+        logger.warning("smart_find_image: 未找到 %s, 尝试了: %s", image_path, tried_levels)
     
     result['debug_info'] = "; ".join(debug_parts)
     return result
@@ -300,19 +1086,61 @@ def find_input_box(templates_dir: str, save_screenshot: bool = False) -> dict:
         smart_find_image 返回的结果字典
     """
     image_path = os.path.join(templates_dir, "input_box.png")
-    return smart_find_image(image_path, save_screenshot=save_screenshot)
+    hint = _locality_region("input_box")
+    result = None
+    if hint:
+        result = smart_find_image(image_path, region=hint, save_screenshot=save_screenshot)
+    window = _window_region()
+    if (not result or not result['found']) and window is not None and not _window_covers_screen(window):
+        result = smart_find_image(image_path, region=window, save_screenshot=save_screenshot)
+    if not result or not result['found']:
+        # 窗口几何缓存可能过期或选错了窗口，最后全屏再找一次
+        result = smart_find_image(image_path, region=None, save_screenshot=save_screenshot)
+    if result['found']:
+        _remember_location("input_box", result['location'])
+    return result
+
+
+def _xdotool(*args: str, timeout: float = 5) -> subprocess.CompletedProcess:
+    """
+    执行一次 xdotool 调用。
+
+    xdotool 支持在一条命令行里串联多个命令（search ... windowactivate ... mousemove ... click），
+    同一个进程、同一个 X 连接内依次执行，比每个动作单独 fork 一次 xdotool 省去数次进程启动开销。
+    """
+    return subprocess.run(['xdotool', *args], check=True, capture_output=True, text=True, timeout=timeout)
+
+
+# activate_window 上次激活的窗口 ID，下次优先直接激活，省去 search
+_active_window_id: Optional[str] = None
 
 
 def activate_window(window_name_pattern: str = "antigravity") -> bool:
     """
     Activate window by name pattern using xdotool.
     
+    The window ID found last time is cached and activated directly;
+    only when that fails (window closed / restarted) do we search again.
+    
     Args:
         window_name_pattern: Window name substring to search for
         
     Returns:
         True if window found and activated, False otherwise
     """
+    global _active_window_id
+    
+    if _active_window_id:
+        try:
+            # --sync waits for the window to be active
+            _xdotool('windowactivate', '--sync', _active_window_id)
+            logger.debug("Activated cached window (ID: %s)", _active_window_id)
+            time.sleep(0.5) # Wait for animation/focus
+            return True
+        except Exception as e:
+            logger.info("Cached window %s not usable (%s), searching again", _active_window_id, e)
+            _active_window_id = None
+    
     try:
         # Search for window ID
         # Only search for visible windows
@@ -326,23 +1154,115 @@ def activate_window(window_name_pattern: str = "antigravity") -> bool:
             
             # Activate window
             # --sync waits for the window to be active
-            subprocess.run(['xdotool', 'windowactivate', '--sync', target_id], check=True)
-            logger.info(f"Activated window '{window_name_pattern}' (ID: {target_id})")
+            _xdotool('windowactivate', '--sync', target_id)
+            _active_window_id = target_id
+            logger.info("Activated window '%s' (ID: %s)", window_name_pattern, target_id)
             time.sleep(0.5) # Wait for animation/focus
             return True
         else:
-            logger.warning(f"Window '{window_name_pattern}' not found")
+            logger.warning("Window '%s' not found", window_name_pattern)
             return False
     except Exception as e:
-        logger.error(f"Error activating window '{window_name_pattern}': {e}")
+        logger.error("Error activating window '%s': %s", window_name_pattern, e)
         return False
 
 
+def _key_args(steps) -> List[str]:
+    """
+    把按键步骤转换为 xdotool 参数。
+
+    steps 中字符串为 xdotool 按键名（如 'ctrl+v'、'Return'），数字为等待秒数。
+    """
+    args: List[str] = []
+    for step in steps:
+        if isinstance(step, (int, float)):
+            args += ['sleep', str(step)]
+        else:
+            args += ['key', '--clearmodifiers', step]
+    return args
+
+
+def _xdotool_click(x: int, y: int, settle: float = 0.2, then_keys=()):
+    """
+    移动鼠标、等待 settle 秒后左键单击，只启动一个 xdotool 进程。
+
+    then_keys 为点击后紧接着发送的按键步骤（见 _key_args），同样在这一次调用内完成。
+    """
+    _xdotool('mousemove', str(x), str(y), 'sleep', str(settle), 'click', '1',
+             *_key_args(then_keys), timeout=10)
+
+
+# 预先写好的 xdotool 脚本，由 _run_macro 通过 stdin 交给一个 xdotool 进程执行
+_MACROS = {
+    'paste_only': ('ctrl+v',),
+    'paste_submit': ('ctrl+v', 0.2, 'Return'),
+    'submit_only': ('Return',),
+}
+_macro_scripts: Dict[str, bytes] = {}
+
+
+def _macro_script(name: str) -> bytes:
+    """返回宏脚本内容（首次使用时生成并缓存在内存中）。"""
+    script = _macro_scripts.get(name)
+    if script is None:
+        args = _key_args(_MACROS[name])
+        # 脚本每行一个命令：key --clearmodifiers ctrl+v / sleep 0.2
+        lines, line = [], []
+        for arg in args:
+            if arg in ('key', 'sleep') and line:
+                lines.append(' '.join(line))
+                line = []
+            line.append(arg)
+        lines.append(' '.join(line))
+        script = ('\n'.join(lines) + '\n').encode()
+        _macro_scripts[name] = script
+    return script
+
+
+def _run_macro(name: str):
+    """
+    执行预编译的按键宏（paste_only / paste_submit / submit_only）。
+
+    脚本直接经管道写入 xdotool 的 stdin，整个序列在一个进程内完成，不落盘
+    （/tmp 下可预测的脚本文件可被其他本地用户替换，xdotool 脚本支持 exec）；
+    失败时回退到 _press_keys。
+    """
+    try:
+        subprocess.run(['xdotool', '-'], input=_macro_script(name), check=True, capture_output=True, timeout=10)
+        return
+    except Exception as e:
+        logger.warning("xdotool macro '%s' failed: %s", name, e)
+    _press_keys(*_MACROS[name])
+
+
+def _press_keys(*steps):
+    """
+    发送按键序列，例如 _press_keys('ctrl+v', 0.2, 'Return')。
+
+    整个序列只用一次 xdotool 调用（key --clearmodifiers），
+    xdotool 失败时回退到 pyautogui。
+    """
+    try:
+        _xdotool(*_key_args(steps), timeout=10)
+        return
+    except Exception as e:
+        logger.warning("xdotool key failed: %s. Falling back to pyautogui.", e)
+    with _no_pause():
+        for step in steps:
+            if isinstance(step, (int, float)):
+                time.sleep(step)
+            elif '+' in step:
+                pyautogui.hotkey(*step.lower().split('+'))
+            else:
+                pyautogui.press(step.lower())
+
+
 def click_input_box(
     templates_dir: str,
     offset_x: int = -20,
     offset_y: int = -10,
-    confidence: float = 0.8
+    confidence: float = 0.8,
+    then_keys: tuple = ()
 ) -> tuple:
     """
     查找并点击输入框 - 公共工具函数
@@ -355,11 +1275,12 @@ def click_input_box(
         offset_x: X轴偏移量（负值向左，默认-20）
         offset_y: Y轴偏移量（负值向上，默认-10）
         confidence: 图像匹配置信度
+        then_keys: 点击后紧接着发送的按键步骤，如 (0.3, 'ctrl+v', 0.5)，
+                   与点击合并为同一次 xdotool 调用
     
     Returns:
         tuple: (success: bool, debug_info: str)
     """
-    import subprocess
     _ensure_pyautogui()
     
     # 确保模板目录可用（防止 _MEI 临时目录被清理）
@@ -368,38 +1289,37 @@ def click_input_box(
     # 1. 尝试激活目标窗口
     activate_window("antigravity")
     
-    image_path = os.path.join(templates_dir, "input_box.png")
-    
     try:
-        location = pyautogui.locateCenterOnScreen(image_path, confidence=confidence)
+        location = _locate_input_box(templates_dir, confidence)
         if location:
-            x = int(location.x) + offset_x
-            y = int(location.y) + offset_y
+            x = int(location[0]) + offset_x
+            y = int(location[1]) + offset_y
             
-            logger.info(f"click_input_box: 找到 input_box.png @ ({location.x}, {location.y}), 点击位置 ({x}, {y})")
+            logger.info("click_input_box: 找到 input_box.png @ (%s, %s), 点击位置 (%s, %s)", location[0], location[1], x, y)
             
-            # 使用 xdotool 点击（更可靠）
-            subprocess.run(['xdotool', 'mousemove', str(x), str(y)], check=True)
-            time.sleep(0.2)
-            subprocess.run(['xdotool', 'click', '1'], check=True)
+            # 使用 xdotool 点击（更可靠），移动、点击与后续按键合并为一次调用
+            _xdotool_click(x, y, then_keys=then_keys)
             
             return True, f"点击成功 @ ({x}, {y})"
         else:
             return False, "未找到 input_box.png"
-    except pyautogui.ImageNotFoundException:
-        return False, "未找到 input_box.png"
     except Exception as e:
-        logger.error(f"click_input_box 错误: {e}")
+        logger.error("click_input_box 错误: %s", e)
         return False, f"错误: {e}"
 
 
-def find_replying(templates_dir: str, confidence: float = 0.9) -> tuple:
+def find_replying(
+    templates_dir: str,
+    confidence: float = 0.9,
+    haystack: Optional[np.ndarray] = None
+) -> tuple:
     """
     查找 Replying 指示器 - 公共工具函数
     
     Args:
         templates_dir: 模板目录路径
         confidence: 图像匹配置信度
+        haystack: 可选的已截取屏幕帧（_screen_gray），传入时不再重新截图
     
     Returns:
         tuple: (found: bool, location: tuple or None)
@@ -411,64 +1331,54 @@ def find_replying(templates_dir: str, confidence: float = 0.9) -> tuple:
     """
     _ensure_pyautogui()
     templates_dir = _ensure_templates(templates_dir)
-    image_path = os.path.join(templates_dir, "Replying.png")
     
     try:
-        location = pyautogui.locateCenterOnScreen(image_path, confidence=confidence)
+        location = _locate_replying(templates_dir, confidence, haystack=haystack)
         if location:
-            logger.info(f"find_replying: 找到 @ ({location.x}, {location.y})")
-            return True, (int(location.x), int(location.y))
+            x, y = int(location[0]), int(location[1])
+            logger.debug("find_replying: 找到 @ (%d, %d)", x, y)
+            return True, (x, y)
         else:
             return False, None
-    except pyautogui.ImageNotFoundException:
-        return False, None
     except Exception as e:
-        logger.error(f"find_replying 错误: {e}")
+        logger.error("find_replying 错误: %s", e)
         return False, None
 
 
-def click_accept_button(templates_dir: str, confidence: float = 0.7) -> tuple:
+def click_accept_button(
+    templates_dir: str,
+    confidence: float = 0.7,
+    haystack: Optional[np.ndarray] = None
+) -> tuple:
     """
     查找并点击 Accept 或 Accept all 按钮 - 公共工具函数
     
     Args:
         templates_dir: 模板目录路径
         confidence: 图像匹配置信度
+        haystack: 可选的已截取屏幕帧（_screen_gray），传入时不再重新截图
     
     Returns:
         tuple: (success: bool, debug_info: str)
     """
-    import subprocess
     
     _ensure_pyautogui()
     templates_dir = _ensure_templates(templates_dir)
-    # 尝试查找的模板列表
-    templates = ["accept_button.png", "accept_all.png"]
     
-    for template_name in templates:
-        image_path = os.path.join(templates_dir, template_name)
-        
-        # 跳过不存在的模板
-        if not os.path.exists(image_path):
-            continue
+    # accept_button.png / accept_all.png 在同一次匹配中检测
+    try:
+        location = _locate_accept(templates_dir, confidence, haystack=haystack)
+        if location:
+            x, y, template_name = int(location[0]), int(location[1]), location[2]
             
-        try:
-            location = pyautogui.locateCenterOnScreen(image_path, confidence=confidence)
-            if location:
-                x, y = int(location.x), int(location.y)
-                
-                logger.info(f"click_accept_button: 找到 {template_name} @ ({x}, {y})")
-                
-                # 使用 xdotool 点击
-                subprocess.run(['xdotool', 'mousemove', str(x), str(y)], check=True)
-                time.sleep(0.2)
-                subprocess.run(['xdotool', 'click', '1'], check=True)
-                
-                return True, f"点击成功 ({template_name}) @ ({x}, {y})"
-        except pyautogui.ImageNotFoundException:
-            continue
-        except Exception as e:
-            logger.error(f"click_accept_button 错误 ({template_name}): {e}")
+            logger.info("click_accept_button: 找到 %s @ (%d, %d)", template_name, x, y)
+            
+            # 使用 xdotool 点击
+            _xdotool_click(x, y)
+            
+            return True, f"点击成功 ({template_name}) @ ({x}, {y})"
+    except Exception as e:
+        logger.error("click_accept_button 错误: %s", e)
     
     return False, "未找到 accept 按钮"
 
@@ -488,7 +1398,7 @@ def set_clipboard(text: str) -> bool:
         pyperclip.copy(text)
         return True
     except Exception as e:
-        logger.warning(f"pyperclip failed, falling back to xclip: {e}")
+        logger.warning("pyperclip failed, falling back to xclip: %s", e)
         try:
             # Fallback to xclip
             process = subprocess.Popen(
@@ -499,20 +1409,71 @@ def set_clipboard(text: str) -> bool:
             process.communicate(input=text, timeout=2)
             return process.returncode == 0
         except Exception as e2:
-            logger.error(f"Error setting clipboard: {e2}")
+            logger.error("Error setting clipboard: %s", e2)
             return False
 
 
-from PIL import Image
+def _wait_clipboard_owner(expected: bytes, target: str = 'image/png', timeout: float = 1.0) -> bool:
+    """
+    轮询 CLIPBOARD 中 target 类型的内容，直到与 expected 完全一致或超时。
 
-# ... (rest of imports)
+    只检查 TARGETS 不够：剪贴板管理器或上一个 xclip 可能仍在提供旧的 image/png，
+    必须读回数据确认新的 xclip 已接管 selection。
+
+    Returns:
+        True 表示剪贴板已提供 expected 数据
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            result = subprocess.run(
+                ['xclip', '-selection', 'clipboard', '-o', '-t', target],
+                capture_output=True, timeout=0.5
+            )
+            if result.returncode == 0 and result.stdout == expected:
+                return True
+        except Exception as e:
+            logger.debug("_wait_clipboard_owner: 读取剪贴板失败: %s", e)
+        time.sleep(0.02)
+    return False
+
+
+def _encode_png(image_path: str) -> Optional[bytes]:
+    """
+    读取图片并返回 PNG 编码的字节；已是 PNG 时直接返回原始字节。
+
+    Returns:
+        PNG bytes，文件不存在或读取失败时返回 None
+    """
+    if not os.path.exists(image_path):
+        logger.error("_encode_png: File not found %s", image_path)
+        return None
+    
+    abs_path = os.path.abspath(image_path)
+    try:
+        with Image.open(abs_path) as img:
+            if img.format != 'PNG':
+                logger.info("Converting %s to PNG for clipboard...", img.format)
+                buf = io.BytesIO()
+                img.save(buf, format="PNG")
+                return buf.getvalue()
+    except Exception as e:
+        logger.error("Error processing image format: %s", e)
+        # Fallback to original bytes if processing fails
+    
+    try:
+        with open(abs_path, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        logger.error("_encode_png: 读取失败 %s: %s", abs_path, e)
+        return None
 
-# ... (previous code)
 
 def set_clipboard_image(image_path: str) -> Tuple[bool, Optional[subprocess.Popen]]:
     """
     Copy image to clipboard using xclip directly.
-    Ensures image is in PNG format before copying.
+    Ensures image is in PNG format before copying; the PNG bytes are
+    piped to xclip's stdin, no temporary file is written.
     Dependencies: xclip, pillow
     
     Args:
@@ -523,90 +1484,78 @@ def set_clipboard_image(image_path: str) -> Tuple[bool, Optional[subprocess.Pope
         NOTE: If successful, the xclip process is returned and MUST be terminated
               by the caller after pasting is complete to release the clipboard.
     """
-    temp_png_path = None
-    try:
-        if not os.path.exists(image_path):
-            logger.error(f"set_clipboard_image: File not found {image_path}")
-            return False, None
-        
-        abs_path = os.path.abspath(image_path)
-        target_path = abs_path
-        
-        # 1. Ensure/Convert to PNG
-        try:
-            with Image.open(abs_path) as img:
-                if img.format != 'PNG':
-                    logger.info(f"Converting {img.format} to PNG for clipboard...")
-                    # Create temporary PNG file
-                    import tempfile
-                    fd, temp_png_path = tempfile.mkstemp(suffix='.png')
-                    os.close(fd)
-                    
-                    img.save(temp_png_path, format="PNG")
-                    target_path = temp_png_path
-                    logger.info(f"Saved temporary PNG to {target_path}")
-        except Exception as e:
-            logger.error(f"Error processing image format: {e}")
-            # Fallback to original path if processing fails
-            target_path = abs_path
+    png_bytes = _encode_png(image_path)
+    if png_bytes is None:
+        return False, None
+    return set_clipboard_image_bytes(png_bytes, label=image_path)
 
-        # 2. Set to Clipboard
-        # Command: xclip -selection clipboard -t image/png -i /path/to/file
-        cmd = ['xclip', '-selection', 'clipboard', '-t', 'image/png', '-i', target_path]
+
+def set_clipboard_image_bytes(
+    png_bytes: bytes,
+    label: str = "<bytes>"
+) -> Tuple[bool, Optional[subprocess.Popen]]:
+    """
+    将已编码好的 PNG 字节交给 xclip 作为剪贴板图片。
+
+    返回值约定与 set_clipboard_image 相同，调用方粘贴完成后须终止返回的 xclip 进程。
+    
+    Args:
+        png_bytes: PNG 编码的图片数据（见 _encode_png）
+        label: 日志中显示的来源名称
+    """
+    try:
+        # Command: xclip -selection clipboard -t image/png -i  (reads stdin)
+        cmd = ['xclip', '-selection', 'clipboard', '-t', 'image/png', '-i']
         
         env = {**os.environ, 'DISPLAY': os.getenv('DISPLAY', ':0')}
         
         # xclip stays running to serve the selection. We must NOT wait for it to exit.
         process = subprocess.Popen(
             cmd,
+            stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             env=env
         )
-        
-        # Wait briefly to see if it crashes immediately
         try:
-            # Wait a tiny bit to check for immediate failure
-            # But xclip SHOULD block, so TimeoutExpired is expected (and good)
-            process.wait(timeout=0.1)
-            
-            # If we are here, it exited. Check return code.
-            if process.returncode != 0:
+            process.stdin.write(png_bytes)
+        finally:
+            process.stdin.close()
+        
+        # xclip 读完输入后才会声明 selection 所有权；
+        # 读回的 image/png 数据与输入一致时说明新 xclip 已接管剪贴板，不必固定等待
+        if process.poll() not in (None, 0):
+            stderr = process.stderr.read() if process.stderr else b""
+            logger.error("set_clipboard_image: Failed (xclip exited) - %s", stderr.decode())
+            return False, None
+        
+        if not _wait_clipboard_owner(png_bytes):
+            returncode = process.poll()
+            if returncode is not None and returncode != 0:
                 stderr = process.stderr.read() if process.stderr else b""
-                logger.error(f"set_clipboard_image: Failed (xclip exited) - {stderr.decode()}")
+                logger.error("set_clipboard_image: Failed (xclip exited) - %s", stderr.decode())
                 return False, None
-                
-            # If it exited with 0 immediately, that's weird for xclip without -l 1,
-            # but maybe it forked? xclip usually doesn't fork by default unless backgrounded.
-            return True, None # It's gone, no process to manage
-            
-        except subprocess.TimeoutExpired:
+            logger.warning("set_clipboard_image: 未能确认剪贴板所有权，继续尝试粘贴")
+        
+        if process.poll() is None:
             # It's still running, which is GOOD for xclip (holding selection)
-            logger.info(f"set_clipboard_image: {target_path} -> Success (xclip running)")
+            logger.info("set_clipboard_image: %s -> Success (xclip running, %s bytes)", label, len(png_bytes))
             return True, process
+        
+        # xclip 已自行 fork 到后台，没有需要管理的进程
+        return True, None
             
     except Exception as e:
-        logger.error(f"Error setting clipboard image (xclip): {e}")
+        logger.error("Error setting clipboard image (xclip): %s", e)
         return False, None
-    finally:
-        # 3. Cleanup temporary file
-        # 注意：如果 xclip 还在运行且使用了 temp file，这一步可能会导致问题？
-        # xclip 需要读取文件内容。通常它会读取进内存吗？
-        # xclip 读取文件应该很快。
-        if temp_png_path and os.path.exists(temp_png_path):
-            try:
-                # 稍微延迟删除，确保 xclip以此读取
-                time.sleep(0.2) 
-                os.remove(temp_png_path)
-                logger.debug(f"Removed temp file {temp_png_path}")
-            except OSError:
-                pass
 
 
 def find_image(
     image_path: str,
     confidence: float = 0.8,
-    region: Optional[Tuple[int, int, int, int]] = None
+    region: Optional[Tuple[int, int, int, int]] = None,
+    haystack: Optional[np.ndarray] = None,
+    grayscale: bool = True
 ) -> Optional[Tuple[int, int]]:
     """
     Find an image template on screen using fuzzy matching.
@@ -615,42 +1564,38 @@ def find_image(
         image_path: Path to the template image
         confidence: Match confidence threshold (0.0 to 1.0)
         region: Optional region to search (x, y, width, height)
+        haystack: Optional pre-grabbed frame (see _screen_gray / _screen_bgr);
+                  when given, no new screenshot is taken
+        grayscale: Match on single-channel images (ignored when haystack is given)
         
     Returns:
         Tuple of (x, y) center coordinates if found, None otherwise
     """
     _ensure_pyautogui()
     try:
-        if not os.path.exists(image_path):
-            logger.error(f"Template image not found: {image_path}")
+        if _get_template(image_path) is None:
+            logger.error("Template image not found: %s", image_path)
             return None
             
-        # Try with confidence (requires opencv)
-        try:
-            location = pyautogui.locateCenterOnScreen(
-                image_path,
-                confidence=confidence,
-                region=region
-            )
-        except pyautogui.ImageNotFoundException:
-            location = None
+        location = _locate(image_path, confidence, region=region, haystack=haystack, grayscale=grayscale)
             
         if location:
-            logger.info(f"Found {image_path} at ({location.x}, {location.y})")
-            return (location.x, location.y)
+            logger.info("Found %s at (%d, %d)", image_path, location[0], location[1])
+            return (location[0], location[1])
         else:
-            logger.debug(f"Image not found on screen: {image_path}")
+            logger.debug("Image not found on screen: %s", image_path)
             return None
             
     except Exception as e:
-        logger.error(f"Error finding image {image_path}: {e}")
+        logger.error("Error finding image %s: %s", image_path, e)
         return None
 
 
 def find_and_click(
     image_path: str,
     confidence: float = 0.8,
-    offset: Tuple[int, int] = (0, 0)
+    offset: Tuple[int, int] = (0, 0),
+    haystack: Optional[np.ndarray] = None
 ) -> Tuple[bool, str]:
     """
     Find an image on screen and click it.
@@ -659,32 +1604,30 @@ def find_and_click(
         image_path: Path to the template image
         confidence: Match confidence threshold
         offset: (x, y) offset from found position
+        haystack: Optional pre-grabbed full-screen frame to search in
         
     Returns:
         Tuple of (success, debug_message)
     """
-    cwd = os.getcwd()
-    display = os.getenv('DISPLAY', 'not set')
-    debug_msg = f"CWD: {cwd}, DISPLAY: {display}. "
+    _ensure_pyautogui()
+    debug_msg = f"{_ENV_INFO}. "
     
-    location = find_image(image_path, confidence)
+    location = find_image(image_path, confidence, haystack=haystack)
     
     if location:
         click_x = location[0] + offset[0]
         click_y = location[1] + offset[1]
         
-        logger.info(f"Found {image_path}, clicking at ({click_x}, {click_y})")
+        logger.info("Found %s, clicking at (%d, %d)", image_path, click_x, click_y)
         
         try:
-            import subprocess
-            subprocess.run(['xdotool', 'mousemove', str(int(click_x)), str(int(click_y))], check=True)
-            time.sleep(0.1)
-            subprocess.run(['xdotool', 'click', '1'], check=True)
+            _xdotool_click(int(click_x), int(click_y), settle=0.1)
         except Exception as e:
-            logger.warning(f"xdotool click failed: {e}. Falling back to pyautogui.")
-            pyautogui.moveTo(click_x, click_y)
-            time.sleep(0.1)
-            pyautogui.click()
+            logger.warning("xdotool click failed: %s. Falling back to pyautogui.", e)
+            with _no_pause():
+                pyautogui.moveTo(click_x, click_y)
+                time.sleep(0.1)
+                pyautogui.click()
         
         return True, "Success"
     else:
@@ -694,16 +1637,43 @@ def find_and_click(
 
 def paste_and_submit():
     """Perform Ctrl+V then Enter keystrokes."""
-    _ensure_pyautogui()
-    logger.info("PasteAndSubmit: Sending Ctrl+V...")
-    pyautogui.hotkey('ctrl', 'v')
-    time.sleep(0.2)
-    
-    logger.info("PasteAndSubmit: Sending Enter...")
-    pyautogui.press('return')
+    logger.info("PasteAndSubmit: Sending Ctrl+V, Enter...")
+    _run_macro('paste_submit')
+
+
+_UPGRADE_TEMPLATES = ["Upgrade.png", "Upgrade2.png", "Upgrade3.png"]
 
 
-def handle_model_switch(templates_dir: str, reply_event=None, send_status: Optional[Callable[[str], None]] = None) -> str:
+def _find_upgrade_popup(templates_dir: str, frame: Optional[np.ndarray] = None) -> Optional[str]:
+    """
+    检测 Upgrade 弹窗（配额耗尽），三个模板在同一帧上匹配。
+
+    Args:
+        templates_dir: 模板目录路径
+        frame: 可选的已截取全屏帧（_screen_gray），不传时截取一帧
+
+    Returns:
+        命中的模板文件名，未发现时返回 None
+    """
+    if frame is None:
+        frame = _screen_gray()
+    if frame is None:
+        return None
+    for template in _UPGRADE_TEMPLATES:
+        image_path = os.path.join(templates_dir, template)
+        if _get_template(image_path) is None:
+            continue
+        if _locate(image_path, 0.8, haystack=frame):
+            return template
+    return None
+
+
+def handle_model_switch(
+    templates_dir: str,
+    reply_event=None,
+    send_status: Optional[Callable[[str], None]] = None,
+    frame: Optional[np.ndarray] = None
+) -> str:
     """
     检查模型配额耗尽并自动尝试切换模型（执行一次 continue）。
     
@@ -713,21 +1683,17 @@ def handle_model_switch(templates_dir: str, reply_event=None, send_status: Optio
     - "NOT_FOUND": 未发现 Upgrade 弹窗
     - "UPGRADE_DETECTED": 发现 Upgrade 弹窗但切换未成功（面板/目标模型未找到）
     - "SWITCHED:*": 成功点击了备用模型并输入了 continue
+    
+    frame: 可选的已截取全屏帧，传入时 Upgrade 检测不再重新截图
     """
     
     _ensure_pyautogui()
     templates_dir = _ensure_templates(templates_dir)
     # 1. 在整个屏幕上查找 "Upgrade.png" 和 "Upgrade2.png"，"Upgrade3.png"找到任意一个才触发切换
-    upgrade_found = False
-    for template in ["Upgrade.png", "Upgrade2.png", "Upgrade3.png"]:
-        res = smart_find_image(os.path.join(templates_dir, template), confidence_levels=[0.8])
-        if res.get('found'):
-            upgrade_found = True
-            logger.info(f"升级弹窗识别成功: {template}, confidence: {res.get('confidence')}")
-            break
-            
-    if not upgrade_found:
+    upgrade_template = _find_upgrade_popup(templates_dir, frame)
+    if not upgrade_template:
         return "NOT_FOUND"
+    logger.info("升级弹窗识别成功: %s, confidence: 0.8", upgrade_template)
         
     logger.info("检测到 Upgrade 弹窗，开始处理单次模型切换")
     from pynput.mouse import Controller, Button
@@ -744,42 +1710,36 @@ def handle_model_switch(templates_dir: str, reply_event=None, send_status: Optio
 
     # 查找 panel-ClaudeOpus.png（全屏，confidence=0.8）
     for conf in [0.8]:
-        try:
-            loc = pyautogui.locateCenterOnScreen(panel_opus, confidence=conf)
-            if loc:
-                found_panel = "opus"
-                panel_loc = (int(loc.x), int(loc.y))
-                logger.info(f"✅ 找到 panel-ClaudeOpus.png @ {panel_loc}, confidence={conf}")
-                break
-        except pyautogui.ImageNotFoundException:
-            pass
+        loc = _locate(panel_opus, conf)
+        if loc:
+            found_panel = "opus"
+            panel_loc = (int(loc[0]), int(loc[1]))
+            logger.info("✅ 找到 panel-ClaudeOpus.png @ %s, confidence=%s", panel_loc, conf)
+            break
 
     # 查找 panel-Gemini.png（全屏，confidence=0.8）
     if not found_panel:
         for conf in [0.8]:
-            try:
-                loc = pyautogui.locateCenterOnScreen(panel_gemini, confidence=conf)
-                if loc:
-                    found_panel = "gemini"
-                    panel_loc = (int(loc.x), int(loc.y))
-                    logger.info(f"✅ 找到 panel-Gemini.png @ {panel_loc}, confidence={conf}")
-                    break
-            except pyautogui.ImageNotFoundException:
-                pass
+            loc = _locate(panel_gemini, conf)
+            if loc:
+                found_panel = "gemini"
+                panel_loc = (int(loc[0]), int(loc[1]))
+                logger.info("✅ 找到 panel-Gemini.png @ %s, confidence=%s", panel_loc, conf)
+                break
         
     if not found_panel:
         logger.warning("❌ 全屏查找均未找到面板")
         try:
             screenshot_path = os.path.join(os.getcwd(), "failed_find_panel.png")
             pyautogui.screenshot().save(screenshot_path)
-            logger.info(f"✅ 已保存现场截图至: {screenshot_path}")
+            logger.info("✅ 已保存现场截图至: %s", screenshot_path)
         except Exception as e:
-            logger.error(f"❌ 现场截图保存失败: {e}")
+            logger.error("❌ 现场截图保存失败: %s", e)
         return "UPGRADE_DETECTED"
         
     # 3. 点击面板（向下偏移 10px，使用 pynput mouse）
     px, py = panel_loc
-    logger.info(f"🖱️ 移动鼠标到 ({px}, {py + 10}) 并点击...")
+    logger.info("🖱️ 移动鼠标到 (%s, %s) 并点击...", px, py + 10)
     time.sleep(1)
     mouse.position = (px, py + 10)
     time.sleep(1)
@@ -803,17 +1763,14 @@ def handle_model_switch(templates_dir: str, reply_event=None, send_status: Optio
     # 全屏查找目标模型（confidence=0.8，与 debug 脚本一致）
     target_loc = None
     for conf in [0.8]:
-        try:
-            loc = pyautogui.locateCenterOnScreen(target_img, confidence=conf)
-            if loc:
-                target_loc = (int(loc.x), int(loc.y))
-                logger.info(f"✅ 找到 {os.path.basename(target_img)} @ {target_loc}, confidence={conf}")
-                break
-        except pyautogui.ImageNotFoundException:
-            pass
+        loc = _locate(target_img, conf)
+        if loc:
+            target_loc = (int(loc[0]), int(loc[1]))
+            logger.info("✅ 找到 %s @ %s, confidence=%s", os.path.basename(target_img), target_loc, conf)
+            break
 
     if not target_loc:
-        logger.error(f"❌ 未找到 {os.path.basename(target_img)}，流程中断")
+        logger.error("❌ 未找到 %s，流程中断", os.path.basename(target_img))
         return "UPGRADE_DETECTED"
 
     # 5. 点击目标模型
@@ -821,15 +1778,13 @@ def handle_model_switch(templates_dir: str, reply_event=None, send_status: Optio
     mouse.position = (tx, ty)
     time.sleep(1)
     mouse.click(Button.left, 1)
-    logger.info(f"✅ {target_name} 点击完成")
+    logger.info("✅ %s 点击完成", target_name)
 
     # 6. 延迟 1 秒，执行 continue（直接粘贴 + 回车，与 debug 脚本一致）
     time.sleep(1)
     set_clipboard("continue")
     time.sleep(0.2)
-    pyautogui.hotkey('ctrl', 'v')
-    time.sleep(0.3)
-    pyautogui.press('return')
+    _press_keys('ctrl+v', 0.3, 'Return')
     logger.info("✅ continue 已提交")
 
     # 7. 发送 TG 通知
@@ -840,22 +1795,82 @@ def handle_model_switch(templates_dir: str, reply_event=None, send_status: Optio
     return f"SWITCHED:{target_name}"
 
 
-def _check_retry(templates_dir: str) -> bool:
+def _check_retry(templates_dir: str, frame: Optional[np.ndarray] = None) -> bool:
     """
     检查并点击 Retry 按钮（IDE 网络断开时弹出）。
     
+    Args:
+        frame: 可选的已截取全屏帧，传入时不再重新截图
+    
     Returns:
         True 如果找到并点击了 Retry 按钮
     """
     templates_dir = _ensure_templates(templates_dir)
     retry_img = os.path.join(templates_dir, "Retry.png")
-    success, debug_info = find_and_click(retry_img, confidence=0.8, offset=(0, 0))
+    success, debug_info = find_and_click(retry_img, confidence=0.8, offset=(0, 0), haystack=frame)
     if success:
-        logger.info(f"_check_retry: Retry 按钮已点击: {debug_info}")
+        logger.info("_check_retry: Retry 按钮已点击: %s", debug_info)
         return True
     return False
 
 
+def _wait_window_title(title: str, timeout: float, reply_event=None) -> Optional[bool]:
+    """
+    等待标题包含 title 的可见窗口出现。
+
+    xdotool search --sync 会阻塞直到窗口出现并打印窗口 ID，
+    用 select 等待其输出，期间不需要任何截图。
+
+    Returns:
+        True 窗口已出现；False 超时或 reply_event 已 set；None xdotool 不可用
+    """
+    try:
+        proc = subprocess.Popen(
+            ['xdotool', 'search', '--sync', '--onlyvisible', '--name', title],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+    except Exception as e:
+        logger.debug("_wait_window_title: 无法启动 xdotool: %s", e)
+        return None
+    try:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if reply_event and reply_event.is_set():
+                return False
+            ready, _, _ = select.select([proc.stdout], [], [], min(0.25, max(deadline - time.time(), 0)))
+            if ready:
+                return bool(proc.stdout.readline().strip())
+        return False
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+class AdaptiveTicker:
+    """
+    自适应轮询间隔。
+
+    画面状态不变时每轮把间隔拉长 1.5 倍（上限 max_delay），
+    状态一变化立即恢复到 min_delay。IDE 长时间回复期间画面基本不变，
+    这样可以显著减少截图和模板匹配次数，同时状态变化时仍能快速响应。
+    """
+
+    def __init__(self, min_delay: float = 0.25, max_delay: float = 2.0, factor: float = 1.5):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.delay = min_delay
+
+    def tick(self, changed: bool):
+        """根据上一轮状态是否变化调整间隔，然后休眠。"""
+        if changed:
+            self.delay = self.min_delay
+        else:
+            self.delay = min(self.delay * self.factor, self.max_delay)
+        time.sleep(self.delay)
+
+
 def monitor_process(
     templates_dir: str,
     send_status: Optional[Callable[[str], None]] = None,
@@ -867,9 +1882,16 @@ def monitor_process(
     阶段 1: 等待 Replying 出现（最多 5 秒，纯等待无监控）
     阶段 2: Replying 可见期间（Accept + 心跳消息，每 10 秒）
     阶段 3: Replying 消失后 3 秒缓冲，统一检测 Retry / Upgrade
+    
+    设置环境变量 AG_REPLYING_TITLE 后，阶段 1 先等待标题包含该文本的窗口出现
+    （xdotool search --sync，事件驱动，不截图），超时再回退到图像检测。
+    
+    阶段 1 / 2 的轮询间隔由 AdaptiveTicker 控制（0.25s 起，画面不变时逐步放宽到 2s），
+    心跳与 Accept 检测按时间间隔触发，与轮询频率无关。
     """
     logger.info("MonitorProcess: Starting...")
     timeout = 300  # 总超时 5 分钟
+    replying_title = os.getenv('AG_REPLYING_TITLE', '')
     overall_start = time.time()
     
     while time.time() - overall_start < timeout:
@@ -877,18 +1899,29 @@ def monitor_process(
         logger.info("MonitorProcess [阶段1]: 等待 Replying 出现...")
         appeared = False
         phase1_start = time.time()
+        ticker = AdaptiveTicker()
+        
+        # 可选：通过窗口标题事件等待（配置了 AG_REPLYING_TITLE 时），不截图
+        if replying_title:
+            appeared = bool(_wait_window_title(replying_title, 5, reply_event))
+            if appeared:
+                logger.info("MonitorProcess [阶段1]: 窗口标题显示 Replying，进入阶段 2。")
         
-        while time.time() - phase1_start < 5:
+        # 图像轮询（默认方式，也是标题等待未命中时的回退；至少检测一帧）
+        checked = False
+        while not appeared and (not checked or time.time() - phase1_start < 5):
             if reply_event and reply_event.is_set():
                 logger.info("MonitorProcess [阶段1]: reply_event 已 set，停止。")
                 return
             
-            found, _ = find_replying(templates_dir)
+            frame = _screen_gray()
+            found, _ = find_replying(templates_dir, haystack=frame)
+            checked = True
             if found:
                 logger.info("MonitorProcess [阶段1]: Replying 已出现！进入阶段 2。")
                 appeared = True
                 break
-            time.sleep(0.5)
+            ticker.tick(changed=False)
         
         if not appeared:
             # Replying 从未出现 → 等同于"Replying 消失"，直接进入阶段 3
@@ -898,38 +1931,46 @@ def monitor_process(
             # ========== 阶段 2: Replying 可见，IDE 正常工作中 ==========
             logger.info("MonitorProcess [阶段2]: IDE 工作中，启动 Accept + 心跳监控。")
             last_heartbeat_time = time.time()
-            not_found_count = 0
+            missing_since = None
+            prev_found = True
+            changed = True
             
             while time.time() - overall_start < timeout:
                 if reply_event and reply_event.is_set():
                     logger.info("MonitorProcess [阶段2]: reply_event 已 set，IDE 已回复。停止。")
                     return
                 
-                time.sleep(1)
+                ticker.tick(changed)
                 
-                found, _ = find_replying(templates_dir)
+                # 每轮只截一次屏，Replying 与 Accept 检测共用同一帧
+                frame = _screen_gray()
+                found, _ = find_replying(templates_dir, haystack=frame)
+                changed = found != prev_found
+                prev_found = found
                 if found:
-                    # Replying 仍然可见，复位消失计数
-                    not_found_count = 0
+                    # Replying 仍然可见，复位消失计时
+                    missing_since = None
                     
                     # 每 10 秒：Accept 点击 + 心跳消息
                     if time.time() - last_heartbeat_time >= 10:
                         # 发送心跳消息
                         if send_status:
                             current_time = time.strftime("%H:%M:%S", time.localtime())
-                            logger.info(f"MonitorProcess [阶段2]: 心跳 ({current_time})")
+                            logger.info("MonitorProcess [阶段2]: 心跳 (%s)", current_time)
                             send_status(f"思考中...({current_time})")
                         # 尝试点击 Accept 按钮
-                        success, info = click_accept_button(templates_dir)
+                        success, info = click_accept_button(templates_dir, haystack=frame)
                         if success:
-                            logger.info(f"MonitorProcess [阶段2]: Accept 已点击: {info}")
+                            logger.info("MonitorProcess [阶段2]: Accept 已点击: %s", info)
                         last_heartbeat_time = time.time()
                 else:
                     # Replying 不可见
-                    not_found_count += 1
-                    logger.info(f"MonitorProcess [阶段2]: Replying 不可见 ({not_found_count}/3)")
+                    if missing_since is None:
+                        missing_since = time.time()
+                    missing_seconds = time.time() - missing_since
+                    logger.info("MonitorProcess [阶段2]: Replying 不可见 (%.1fs/3s)", missing_seconds)
                     
-                    if not_found_count >= 3:
+                    if missing_seconds >= 3:
                         # 消失超过 3 秒 → 进入阶段 3
                         logger.info("MonitorProcess [阶段2]: Replying 已消失 3 秒，进入阶段 3 检测。")
                         break
@@ -944,29 +1985,25 @@ def monitor_process(
             return
         
         logger.info("MonitorProcess [阶段3]: 开始检测 Retry / Upgrade...")
+        templates_dir = _ensure_templates(templates_dir)
+        # Retry 与 Upgrade 检测共用同一帧
+        frame = _screen_gray()
         
         # 3a. 检查 Retry 按钮（网络断开）
-        if _check_retry(templates_dir):
+        if _check_retry(templates_dir, frame):
             logger.info("MonitorProcess [阶段3]: 发现 Retry，已点击恢复。等待 3 秒后回到阶段 1...")
             time.sleep(3)
             continue  # 回到阶段 1
         
         # 3b. 检查 Upgrade 弹窗（配额耗尽）
-        switch_status = handle_model_switch(templates_dir, reply_event, send_status)
+        switch_status = handle_model_switch(templates_dir, reply_event, send_status, frame=frame)
         if switch_status and switch_status.startswith("SWITCHED"):
             switched_to = switch_status.split(":", 1)[1] if ":" in switch_status else "未知模型"
-            logger.info(f"MonitorProcess [阶段3]: 配额耗尽，已切换模型至 {switched_to} + 发送 continue。等待 5 秒后复检...")
+            logger.info("MonitorProcess [阶段3]: 配额耗尽，已切换模型至 %s + 发送 continue。等待 5 秒后复检...", switched_to)
             time.sleep(5)
             
             # 复检：切换后 Upgrade 弹窗是否仍然存在
-            still_upgrade = False
-            for template in ["Upgrade.png", "Upgrade2.png", "Upgrade3.png"]:
-                res = smart_find_image(os.path.join(templates_dir, template), confidence_levels=[0.8])
-                if res.get('found'):
-                    still_upgrade = True
-                    break
-            
-            if still_upgrade:
+            if _find_upgrade_popup(templates_dir):
                 # 所有模型配额都耗尽了，停止循环
                 logger.warning("MonitorProcess [阶段3]: 切换后仍检测到 Upgrade，所有模型配额已耗尽。退出。")
                 if send_status:
@@ -988,8 +2025,6 @@ def monitor_process(
         return
     
     logger.warning("MonitorProcess: 总超时 300 秒，退出。")
-    
-
 
 
 def full_workflow(
@@ -1027,23 +2062,14 @@ def full_workflow(
         send_status("错误: 无法复制到剪贴板")
         return
     
-    # 2. 点击输入框
-    success, debug_info = click_input_box(templates_dir)
+    # 2-4. 点击输入框 → Ctrl+V 粘贴 → Enter 提交（同一次 xdotool 调用）
+    logger.info("点击输入框，粘贴文本并提交...")
+    success, debug_info = click_input_box(templates_dir, then_keys=(0.3, 'ctrl+v', 0.3, 'Return'))
     if not success:
-        logger.error(f"Could not click input_box: {debug_info}")
+        logger.error("Could not click input_box: %s", debug_info)
         send_status(f"错误: 无法点击输入框. {debug_info}")
         return
     
-    # 3. Ctrl+V 粘贴
-    time.sleep(0.3)
-    logger.info("粘贴文本...")
-    pyautogui.hotkey('ctrl', 'v')
-    time.sleep(0.3)
-    
-    # 4. Enter 提交
-    logger.info("提交...")
-    pyautogui.press('return')
-    
     # 5. 监控循环
     monitor_process(templates_dir, send_status, reply_event)
 
@@ -1064,7 +2090,7 @@ def full_workflow_image(
     # 1. Copy Image to Clipboard
     success, clip_process = set_clipboard_image(image_path)
     if not success:
-        logger.error(f"Error setting clipboard image: {image_path}")
+        logger.error("Error setting clipboard image: %s", image_path)
         send_status(f"Error setting clipboard image: {image_path}")
         return
     
@@ -1091,7 +2117,7 @@ def full_workflow_image(
                 clip_process.terminate()
                 clip_process.wait(timeout=1)
             except Exception as e:
-                logger.warning(f"Error cleaning up xclip: {e}")
+                logger.warning("Error cleaning up xclip: %s", e)
 
 
 def full_workflow_media_group(
@@ -1138,42 +2164,70 @@ def full_workflow_media_group(
     if file_paths is None:
         file_paths = []
     # 1. 处理每张图片
-    for i, img_path in enumerate(image_paths):
-        logger.info(f"处理图片 {i+1}/{len(image_paths)}: {img_path}")
-        
-        # 复制图片到剪贴板
-        success, clip_process = set_clipboard_image(img_path)
-        if not success:
-            logger.error(f"无法复制图片到剪贴板: {img_path}")
-            send_status(f"错误: 无法复制图片 {i+1}")
-            continue
+    # 后台线程预先做 PNG 编码，与上一张图的点击/粘贴等待重叠；
+    # 剪贴板是共享资源，xclip 设置仍在主线程按顺序进行
+    pending: queue.Queue = queue.Queue(maxsize=1)
+    stop_producer = threading.Event()
+    
+    def produce():
+        # 每张图片都必须入队一项（失败为 None），否则主线程会在 pending.get() 上永久阻塞
+        for path in image_paths:
+            try:
+                png = _encode_png(path)
+            except Exception as e:  # cv2/PIL 异常、MemoryError 等
+                logger.error("PNG 编码异常: %s: %s", path, e)
+                png = None
+            while not stop_producer.is_set():
+                try:
+                    pending.put(png, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if stop_producer.is_set():
+                return
+    
+    if image_paths:
+        threading.Thread(target=produce, name="png-encoder", daemon=True).start()
+    
+    try:
+        for i, img_path in enumerate(image_paths):
+            logger.info("处理图片 %d/%d: %s", i + 1, len(image_paths), img_path)
             
-        try:
-            # 点击输入框
-            success, debug_info = click_input_box(templates_dir)
+            # 复制图片到剪贴板（PNG 已由后台线程编码好）
+            png_bytes = pending.get()
+            if png_bytes is None:
+                logger.error("无法复制图片到剪贴板: %s", img_path)
+                send_status(f"错误: 无法复制图片 {i+1}")
+                continue
+            success, clip_process = set_clipboard_image_bytes(png_bytes, label=img_path)
             if not success:
-                logger.error(f"无法点击输入框: {debug_info}")
-                send_status(f"错误: 无法点击输入框. {debug_info}")
-                return
+                logger.error("无法复制图片到剪贴板: %s", img_path)
+                send_status(f"错误: 无法复制图片 {i+1}")
+                continue
             
-            # Ctrl+V 粘贴
-            time.sleep(0.3)
-            logger.info("粘贴图片...")
-            pyautogui.hotkey('ctrl', 'v')
-            time.sleep(0.5)
+            try:
+                # 点击输入框 + Ctrl+V 粘贴
+                logger.info("粘贴图片...")
+                success, debug_info = click_input_box(templates_dir, then_keys=(0.3, 'ctrl+v', 0.5))
+                if not success:
+                    logger.error("无法点击输入框: %s", debug_info)
+                    send_status(f"错误: 无法点击输入框. {debug_info}")
+                    return
             
-        finally:
-            # Cleanup clipboard process ALWAYS
-            if clip_process:
-                try:
-                    clip_process.terminate()
-                    clip_process.wait(timeout=1)
-                except:
-                    pass
+            finally:
+                # Cleanup clipboard process ALWAYS
+                if clip_process:
+                    try:
+                        clip_process.terminate()
+                        clip_process.wait(timeout=1)
+                    except:
+                        pass
+    finally:
+        stop_producer.set()
     
     # 2. 处理每个非图片文件（使用 @路径 格式）
     for i, file_path in enumerate(file_paths):
-        logger.info(f"处理文件 {i+1}/{len(file_paths)}: {file_path}")
+        logger.info("处理文件 %d/%d: %s", i + 1, len(file_paths), file_path)
         
         # 获取绝对路径并构造 @路径 格式
         abs_path = os.path.abspath(file_path)
@@ -1181,22 +2235,17 @@ def full_workflow_media_group(
         
         # 复制 @路径 到剪贴板
         if not set_clipboard(file_ref):
-            logger.error(f"无法复制文件路径到剪贴板: {file_ref}")
+            logger.error("无法复制文件路径到剪贴板: %s", file_ref)
             send_status(f"错误: 无法复制文件 {i+1}")
             continue
         
-        # 点击输入框
-        success, debug_info = click_input_box(templates_dir)
+        # 点击输入框 + Ctrl+V 粘贴
+        logger.info("粘贴文件路径: %s", file_ref)
+        success, debug_info = click_input_box(templates_dir, then_keys=(0.3, 'ctrl+v', 0.5))
         if not success:
-            logger.error(f"无法点击输入框: {debug_info}")
+            logger.error("无法点击输入框: %s", debug_info)
             send_status(f"错误: 无法点击输入框. {debug_info}")
             return
-        
-        # Ctrl+V 粘贴
-        time.sleep(0.3)
-        logger.info(f"粘贴文件路径: {file_ref}")
-        pyautogui.hotkey('ctrl', 'v')
-        time.sleep(0.5)
     
     # 3-5. 处理文字
     if text:
@@ -1207,24 +2256,19 @@ def full_workflow_media_group(
             logger.error("无法复制文字到剪贴板")
             send_status("错误: 无法复制文字")
         else:
-            # 点击输入框
-            success, debug_info = click_input_box(templates_dir)
+            # 点击输入框 + Ctrl+V 粘贴
+            logger.info("粘贴文字...")
+            success, debug_info = click_input_box(templates_dir, then_keys=(0.3, 'ctrl+v', 0.3))
             if not success:
-                logger.error(f"无法点击输入框: {debug_info}")
+                logger.error("无法点击输入框: %s", debug_info)
                 send_status(f"错误: 无法点击输入框. {debug_info}")
                 return
-            
-            # Ctrl+V 粘贴
-            time.sleep(0.3)
-            logger.info("粘贴文字...")
-            pyautogui.hotkey('ctrl', 'v')
-            time.sleep(0.3)
     
     # 5. Enter 提交
     logger.info("等待上传稳定...")
     time.sleep(2)
     logger.info("提交...")
-    pyautogui.press('return')
+    _run_macro('submit_only')
     
     # 6. 监控循环
     monitor_process(templates_dir, send_status, reply_event)
@@ -14,20 +14,22 @@ import sys
 _original_stdout = sys.stdout  # Save for MCP use
 sys.stdout = sys.stderr  # Redirect stdout to stderr to prevent pollution
 
+import heapq
+import io
 import logging
+import operator
 import os
+import queue
+import shutil
+import tempfile
 import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
 
 
-try:
-    from dotenv import load_dotenv
-except ImportError:
-    load_dotenv = None
 from telegram import Bot, Message, Update
 from telegram.utils.helpers import escape_markdown
 from telegram.ext import (
@@ -40,17 +42,20 @@ from telegram.ext import (
 
 from automation.gui_automation import (
     backup_templates,
+    capture_screen_png,
     full_workflow,
     full_workflow_media_group,
+    warm_up,
 )
 from automation.cli_automation import CLIBridge
 from mcp.server import MCPServer
 
 
 # Configure logging to file (stdout reserved for MCP)
+# 默认 INFO，排查问题时可设置 AG_LOGLEVEL=DEBUG
 log_file = '/tmp/gravity_main_debug.log'
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv('AG_LOGLEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler(log_file),
@@ -61,21 +66,285 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Determine templates directory（进程内不变，导入时计算一次）
+# PyInstaller: sys._MEIPASS | Dev: script_dir
+if hasattr(sys, '_MEIPASS'):
+    _TEMPLATES_DIR = os.path.join(sys._MEIPASS, "templates")
+else:
+    _TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# 批次下载目录：优先放在内存盘 /dev/shm，文件只被读取一次随即删除，无需落盘
+_SHM_DIR = '/dev/shm'
+_SHM_MIN_FREE = 256 * 1024 * 1024  # /dev/shm 剩余空间低于此值时退回系统临时目录
+
+
+def _make_batch_dir(chat_id: int) -> str:
+    """
+    为一个批次创建独立的下载目录，处理完后整体删除。
+
+    /dev/shm 不存在、只读、空间不足或不可写（如容器内）时退回系统临时目录。
+    """
+    prefix = f"tg_batch_{chat_id}_"
+    try:
+        if shutil.disk_usage(_SHM_DIR).free >= _SHM_MIN_FREE:
+            return tempfile.mkdtemp(prefix=prefix, dir=_SHM_DIR)
+    except OSError as e:
+        logger.warning("无法在 %s 创建批次目录，改用临时目录: %s", _SHM_DIR, e)
+    return tempfile.mkdtemp(prefix=prefix)
+
+
+# 图片扩展名列表
+IMAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'})
+
+# 批次内按消息 ID 排序的 key（C 实现，比 lambda 快）
+_MESSAGE_ID = operator.attrgetter('message_id')
+
 
 @dataclass
 class MessageBuffer:
-    """Aggregates messages for a specific chat."""
-    messages: List[Message] = field(default_factory=list)
-    timer: Optional[threading.Timer] = None
+    """
+    Aggregates messages for a specific chat.
+
+    deque.append / popleft are atomic in CPython, so _process_batch drains
+    without racing producers; handlers only hold a short lock for the
+    buffer_map LRU bookkeeping.
+    """
+    messages: Deque[Message] = field(default_factory=deque)
+
+
+class BatchScheduler:
+    """
+    按 key（chat_id）做静默期去抖的单线程调度器。
+
+    每条消息只需推入一个 (deadline, key, version) 并唤醒调度线程，
+    不再为每条消息创建/取消一个 threading.Timer（各自一个 OS 线程）。
+    同一 key 只有最新 version 的条目有效，旧条目到期时直接丢弃；
+    到期后在新线程中执行回调，避免慢的批处理阻塞其他 chat 的调度。
+    """
+
+    def __init__(self, callback: Callable[[int], None], delay: float):
+        self._callback = callback
+        self._delay = delay
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, int]] = []
+        self._versions: Dict[int, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def schedule(self, key: int, delay: Optional[float] = None):
+        """（重新）开始 key 的静默计时，delay 秒内无新调用则触发回调（默认使用构造时的 delay）。"""
+        if delay is None:
+            delay = self._delay
+        with self._cond:
+            version = self._versions.get(key, 0) + 1
+            self._versions[key] = version
+            heapq.heappush(self._heap, (time.monotonic() + delay, key, version))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _next_due(self) -> Optional[int]:
+        """阻塞直到有 key 到期并返回它；stop() 后返回 None。"""
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, key, version = self._heap[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                heapq.heappop(self._heap)
+                if self._versions.get(key) == version:
+                    del self._versions[key]
+                    return key
+            return None
+
+    def _run(self):
+        while True:
+            key = self._next_due()
+            if key is None:
+                return
+            threading.Thread(target=self._callback, args=(key,), daemon=True).start()
+
+
+class StatusBatcher:
+    """
+    合并短时间内连续产生的状态消息。
+
+    push() 的消息先缓存，window 秒内的后续消息合并为一条发送；
+    积压达到 max_pending 条或调用 flush() 时立即发送。
+    "取出缓存 + 发送" 在 _send_lock 下串行执行，定时器线程与 push() 触发的发送
+    不会交错，状态消息按 push() 的顺序送达。flush(final=True) 之后不再启动定时器，
+    之后的 push() 直接按顺序发送。
+    """
+
+    def __init__(self, send_func: Callable[[str], None], window: float = 0.2, max_pending: int = 5):
+        self._send = send_func
+        self._window = window
+        self._max_pending = max_pending
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+
+    def push(self, status: str):
+        with self._lock:
+            self._pending.append(status)
+            if not self._closed and len(self._pending) < self._max_pending:
+                if self._timer is None:
+                    self._timer = threading.Timer(self._window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self, final: bool = False):
+        """立即发送所有缓存的状态消息（合并为一条）；final=True 表示之后不再合并。"""
+        with self._send_lock:
+            with self._lock:
+                if final:
+                    self._closed = True
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending, self._pending = self._pending, []
+            if pending:
+                self._send("\n".join(pending))
+
+
+@dataclass
+class OutgoingMessage:
+    """TelegramSender 队列中的一条待发送消息，发送完成后 done 被 set。"""
+    chat_id: Union[int, str]
+    text: str
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Optional[Exception] = None
+
+
+class TelegramSender:
+    """
+    单线程 Telegram 发送队列。
+
+    window 秒内发往同一 chat 的消息合并为一条（以空行分隔，不超过 max_length 字符），
+    并用令牌桶把请求速率限制在 rate 条/秒以内，避免触发 429。
+    send() 阻塞到所在的合并消息发送完成，返回发送时的异常（成功为 None）。
+    """
+
+    def __init__(self, send_func: Callable[[Union[int, str], str], None], rate: float = 30.0,
+                 window: float = 0.02, max_length: int = 4096):
+        self._send = send_func
+        self._rate = rate
+        self._window = window
+        self._max_length = max_length
+        self._queue: "queue.SimpleQueue[OutgoingMessage]" = queue.SimpleQueue()
+        self._tokens = rate
+        self._refilled_at = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def send(self, chat_id: Union[int, str], text: str) -> Optional[Exception]:
+        item = OutgoingMessage(chat_id, text)
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telegram-sender", daemon=True)
+                self._thread.start()
+        self._queue.put(item)
+        item.done.wait()
+        return item.error
+
+    def _collect(self) -> List[OutgoingMessage]:
+        """阻塞取出一条消息，再收集 window 秒内到达的其余消息。"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _group(self, batch: List[OutgoingMessage]) -> List[List[OutgoingMessage]]:
+        """按 chat 分组并保持顺序，合并后的文本不超过 max_length。"""
+        groups: List[List[OutgoingMessage]] = []
+        open_groups: Dict[Union[int, str], Tuple[List[OutgoingMessage], int]] = {}
+        for item in batch:
+            entry = open_groups.get(item.chat_id)
+            if entry is not None:
+                group, length = entry
+                length += 2 + len(item.text)
+                if length <= self._max_length:
+                    group.append(item)
+                    open_groups[item.chat_id] = (group, length)
+                    continue
+            group = [item]
+            groups.append(group)
+            open_groups[item.chat_id] = (group, len(item.text))
+        return groups
+
+    def _acquire(self):
+        """令牌桶：取一个令牌，不足时等待补充。"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._rate, self._tokens + (now - self._refilled_at) * self._rate)
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            time.sleep((1 - self._tokens) / self._rate)
+
+    def _run(self):
+        while True:
+            for group in self._group(self._collect()):
+                self._acquire()
+                error = None
+                try:
+                    self._send(group[0].chat_id, "\n\n".join(item.text for item in group))
+                except Exception as e:
+                    error = e
+                for item in group:
+                    item.error = error
+                    item.done.set()
 
 
 class AntigravityBridge:
     """Main application class for Antigravity-Bridge."""
     
+    # 单批次并行下载的最大线程数
+    MAX_DOWNLOAD_WORKERS = 8
+    # Dispatcher 工作线程数（run_async 处理器在这些线程中运行）
+    DISPATCHER_WORKERS = 4
+    # Bot 复用的 HTTPS 长连接池大小，按实际并发调用方计算：
+    # 并行下载 + telegram-sender 线程（MCP 回复）+ run_async 处理器
+    # + 轮询/同步处理器所在的 Dispatcher 线程 + 批处理线程的状态消息
+    TELEGRAM_POOL_SIZE = MAX_DOWNLOAD_WORKERS + 1 + DISPATCHER_WORKERS + 2
+    # buffer_map 最多保留的 chat 数（超出时淘汰最久未活动且已清空的 buffer）
+    MAX_BUFFERED_CHATS = 1024
+    # 单个 chat 积压的消息数达到上限时不再等待静默期，立即处理
+    MAX_BUFFERED_MESSAGES = 100
+    
     def __init__(self):
-        self.buffer_map: Dict[int, MessageBuffer] = defaultdict(MessageBuffer)
-        self.buffer_lock = threading.Lock()
+        # 按最近活动排序的 chat_id -> MessageBuffer（LRU）
+        self.buffer_map: "OrderedDict[int, MessageBuffer]" = OrderedDict()
+        self._buffer_lock = threading.Lock()
+        # Wait 4 seconds quiescence before processing (多图消息需要更长时间到达)
+        self.batch_scheduler = BatchScheduler(self._process_batch, delay=4.0)
         self.bot: Optional[Bot] = None
+        # MCP 回复经由发送队列：合并同一 chat 的突发消息并限速
+        self.telegram_sender = TelegramSender(
+            lambda chat_id, text: self.bot.send_message(chat_id=chat_id, text=text)
+        )
         self.templates_dir: str = ""
         self.mcp_server: Optional[MCPServer] = None  # MCP Server 引用，用于设置 last_chat_id
         self.ALLOWED_CHAT_IDS: list = []  # 从 .env 读取
@@ -88,8 +357,14 @@ class AntigravityBridge:
         """Initialize the application."""
         # 优先从环境变量读取（MCP mcp_config.json 会自动注入）
         # 如果环境变量不存在，才尝试从 .env 文件加载（兼容 daemon 模式）
-        if not os.getenv('TELEGRAM_BOT_TOKEN') and load_dotenv:
-            load_dotenv()
+        # 只在需要时才导入 dotenv，MCP 模式下省去模块导入和 .env 读取
+        if not os.getenv('TELEGRAM_BOT_TOKEN'):
+            try:
+                from dotenv import load_dotenv
+            except ImportError:
+                pass
+            else:
+                load_dotenv()
         
         token = os.getenv('TELEGRAM_BOT_TOKEN')
         if not token:
@@ -100,27 +375,28 @@ class AntigravityBridge:
         chat_id_str = os.getenv('TELEGRAM_CHAT_ID', '')
         if chat_id_str:
             self.ALLOWED_CHAT_IDS = [int(cid.strip()) for cid in chat_id_str.split(',') if cid.strip()]
-            logger.info(f"Allowed chat IDs: {self.ALLOWED_CHAT_IDS}")
+            logger.info("Allowed chat IDs: %s", self.ALLOWED_CHAT_IDS)
         else:
             logger.warning("TELEGRAM_CHAT_ID not set, no chat IDs allowed")
         
-        # Determine templates directory
-        # PyInstaller: sys._MEIPASS | Dev: script_dir
-        if hasattr(sys, '_MEIPASS'):
-            self.templates_dir = os.path.join(sys._MEIPASS, "templates")
-        else:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            self.templates_dir = os.path.join(script_dir, "templates")
+        self.templates_dir = _TEMPLATES_DIR
         
-        logger.info(f"Started. Script: {__file__}, TemplatesDir: {self.templates_dir}, "
-                   f"DISPLAY: {os.getenv('DISPLAY', 'not set')}")
+        logger.info("Started. Script: %s, TemplatesDir: %s, DISPLAY: %s",
+                    __file__, self.templates_dir, os.getenv('DISPLAY', 'not set'))
         
         # PyInstaller 二进制模式下，将模板备份到持久化目录
         # 防止 _MEI* 临时目录被系统清理或多实例竞争时丢失
         if hasattr(sys, '_MEIPASS'):
             backup_templates(self.templates_dir)
         # Initialize Telegram bot
-        self.updater = Updater(token=token, use_context=True)
+        # Bot 内部通过 urllib3 连接池复用到 api.telegram.org 的 TCP+TLS 连接；
+        # 池要能容纳所有并发调用方，否则多出的请求每次都要重新握手
+        self.updater = Updater(
+            token=token,
+            use_context=True,
+            workers=self.DISPATCHER_WORKERS,
+            request_kwargs={'con_pool_size': self.TELEGRAM_POOL_SIZE},
+        )
         self.bot = self.updater.bot
         
         # Initialize CLI Bridge
@@ -135,7 +411,7 @@ class AntigravityBridge:
                 try:
                     self.bot.send_message(chat_id=chat_id, text=f"💻 [CLI] \n{text}")
                 except Exception as e:
-                    logger.error(f"Failed to send CLI message to Telegram: {e}")
+                    logger.error("Failed to send CLI message to Telegram: %s", e)
             else:
                 logger.error("No chat_id available to send CLI message.")
                 
@@ -149,11 +425,11 @@ class AntigravityBridge:
         # 命令处理器
         dp.add_handler(CommandHandler('start', self.handle_help_command))
         dp.add_handler(CommandHandler('help', self.handle_help_command))
-        dp.add_handler(CommandHandler('screen', self.handle_screen_command))
+        dp.add_handler(CommandHandler('screen', self.handle_screen_command, run_async=True))
         dp.add_handler(CommandHandler('mode', self.handle_mode_command))
         dp.add_handler(CommandHandler('cd', self.handle_cd_command))
         dp.add_handler(CommandHandler('status', self.handle_status_command))
-        dp.add_handler(CommandHandler('quota', self.handle_quota_command))
+        dp.add_handler(CommandHandler('quota', self.handle_quota_command, run_async=True))
         dp.add_handler(CommandHandler('cancel', self.handle_cancel_command))
         dp.add_handler(CommandHandler('exit', self.handle_exit_command))
         dp.add_handler(CommandHandler('sessions', self.handle_sessions_command))
@@ -167,13 +443,13 @@ class AntigravityBridge:
         dp.add_handler(CommandHandler('ls', self.handle_ls_command))
         dp.add_handler(CommandHandler('cat', self.handle_cat_command))
         dp.add_handler(CommandHandler('repeat', self.handle_repeat_command))
-        dp.add_handler(CommandHandler('search', self.handle_search_command))
+        dp.add_handler(CommandHandler('search', self.handle_search_command, run_async=True))
         dp.add_handler(CommandHandler('tail', self.handle_tail_command))
-        dp.add_handler(CommandHandler('run', self.handle_run_command))
-        dp.add_handler(CommandHandler('diff', self.handle_diff_command))
-        dp.add_handler(CommandHandler('tree', self.handle_tree_command))
+        dp.add_handler(CommandHandler('run', self.handle_run_command, run_async=True))
+        dp.add_handler(CommandHandler('diff', self.handle_diff_command, run_async=True))
+        dp.add_handler(CommandHandler('tree', self.handle_tree_command, run_async=True))
         dp.add_handler(CommandHandler('open', self.handle_open_command))
-        dp.add_handler(CommandHandler('gitstatus', self.handle_gitstatus_command))
+        dp.add_handler(CommandHandler('gitstatus', self.handle_gitstatus_command, run_async=True))
         dp.add_handler(CommandHandler('history', self.handle_history_command))
         dp.add_handler(CommandHandler('model', self.handle_model_command))
         
@@ -219,7 +495,7 @@ class AntigravityBridge:
             self.bot.set_my_commands(commands)
             logger.info("Bot commands menu registered.")
         except Exception as e:
-            logger.warning(f"Failed to set bot commands: {e}")
+            logger.warning("Failed to set bot commands: %s", e)
         
         return True
 
@@ -293,35 +569,49 @@ class AntigravityBridge:
     def handle_screen_command(self, update: Update, context: CallbackContext):
         """处理 /screen 命令：截取屏幕并发送图片"""
         chat_id = update.effective_chat.id
-        logger.info(f"Received /screen command from {chat_id}")
+        logger.info("Received /screen command from %s", chat_id)
         
         try:
             import subprocess
             
-            # 截取屏幕
-            screenshot_path = '/tmp/telegram_screenshot.png'
-            result = subprocess.run(
-                ['scrot', screenshot_path],
-                capture_output=True,
-                timeout=10
-            )
+            # 截取屏幕：优先进程内 mss 截图（与 GUI 模板匹配共用），
+            # 其次 `scrot -` 直接输出到 stdout，PNG 都不落盘
+            png_bytes = capture_screen_png() or b''
+            if not png_bytes:
+                result = subprocess.run(
+                    ['scrot', '-'],
+                    capture_output=True,
+                    timeout=10
+                )
+                png_bytes = result.stdout if result.returncode == 0 else b''
+            
+            if not png_bytes:
+                # 旧版 scrot 不支持 '-'，回退到临时文件
+                screenshot_path = '/tmp/telegram_screenshot.png'
+                result = subprocess.run(
+                    ['scrot', screenshot_path],
+                    capture_output=True,
+                    timeout=10
+                )
+                if result.returncode == 0:
+                    with open(screenshot_path, 'rb') as f:
+                        png_bytes = f.read()
             
-            if result.returncode == 0:
+            if png_bytes:
                 # 发送图片到 Telegram
-                with open(screenshot_path, 'rb') as photo:
-                    self.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=photo,
-                        caption="📸 当前屏幕截图"
-                    )
-                logger.info(f"Screenshot sent to {chat_id}")
+                self.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=io.BytesIO(png_bytes),
+                    caption="📸 当前屏幕截图"
+                )
+                logger.info("Screenshot sent to %s", chat_id)
             else:
                 self.bot.send_message(
                     chat_id=chat_id,
                     text="❌ 截屏失败"
                 )
         except Exception as e:
-            logger.error(f"Screenshot error: {e}")
+            logger.error("Screenshot error: %s", e)
             self.bot.send_message(
                 chat_id=chat_id,
                 text=f"❌ 截屏失败: {e}"
@@ -571,11 +861,12 @@ class AntigravityBridge:
     
     def handle_message(self, update: Update, context: CallbackContext):
         """Buffer incoming messages and process in batches."""
-        # 强制打印调试信息
-        try:
-            logger.info(f"handle_message received update: {update}")
-        except Exception as e:
-            logger.error(f"Error logging update: {e}")
+        # Update 的 repr 开销较大，仅在 DEBUG 级别下生成
+        if logger.isEnabledFor(logging.DEBUG):
+            try:
+                logger.debug("handle_message received update: %s", update)
+            except Exception as e:
+                logger.error("Error logging update: %s", e)
 
         if not update.message:
             return
@@ -585,55 +876,80 @@ class AntigravityBridge:
         
         # 检查 chat_id 是否在白名单中
         if chat_id not in self.ALLOWED_CHAT_IDS:
-            logger.warning(f"Ignored message from unauthorized chat_id: {chat_id}")
+            logger.warning("Ignored message from unauthorized chat_id: %s", chat_id)
             return
         
         # 更新 MCP Server 的 last_chat_id，用于自动回复
         if self.mcp_server:
             self.mcp_server.set_last_chat_id(str(chat_id))
         
-        with self.buffer_lock:
-            buf = self.buffer_map[chat_id]
-            buf.messages.append(message)
-            
-            logger.info(f"Buffered message from {chat_id}. Total: {len(buf.messages)}")
-            
-            # Reset/Start Timer
-            if buf.timer:
-                buf.timer.cancel()
-            
-            # Wait 4 seconds quiescence before processing (多图消息需要更长时间到达)
-            buf.timer = threading.Timer(
-                4.0,
-                self._process_batch,
-                args=(chat_id,)
-            )
-            buf.timer.start()
+        # 加锁保证淘汰与 append 不交错，消息不会追加到已被移出的 buffer
+        with self._buffer_lock:
+            buf = self.buffer_map.get(chat_id)
+            if buf is None:
+                buf = self.buffer_map[chat_id] = MessageBuffer()
+                buf.messages.append(message)
+                self._evict_idle_buffers()
+            else:
+                self.buffer_map.move_to_end(chat_id)
+                buf.messages.append(message)
+            pending = len(buf.messages)
+        
+        logger.info("Buffered message from %s. Total: %d", chat_id, pending)
+        
+        if pending >= self.MAX_BUFFERED_MESSAGES:
+            # 积压过多，立即处理，不再等待静默期
+            logger.warning("Chat %s reached %d buffered messages, processing now", chat_id, pending)
+            self.batch_scheduler.schedule(chat_id, delay=0)
+        else:
+            # Reset/Start quiescence timer
+            self.batch_scheduler.schedule(chat_id)
+    
+    def _evict_idle_buffers(self):
+        """从最久未活动的一端淘汰已清空的 buffer，直到数量不超过 MAX_BUFFERED_CHATS（需持有 _buffer_lock）。"""
+        excess = len(self.buffer_map) - self.MAX_BUFFERED_CHATS
+        if excess <= 0:
+            return
+        idle = []
+        for key, buf in self.buffer_map.items():
+            if not buf.messages:
+                idle.append(key)
+                if len(idle) >= excess:
+                    break
+        for key in idle:
+            del self.buffer_map[key]
     
     def _process_batch(self, chat_id: int):
         """Process a batch of buffered messages."""
-        with self.buffer_lock:
-            if chat_id not in self.buffer_map:
-                return
-            buf = self.buffer_map.pop(chat_id)
-            messages = buf.messages
+        buf = self.buffer_map.get(chat_id)
+        if buf is None:
+            return
+        # 逐条 popleft 取出：与并发的 append 不冲突，取出后到达的消息留给下一批
+        messages: List[Message] = []
+        while True:
+            try:
+                messages.append(buf.messages.popleft())
+            except IndexError:
+                break
         
         if not messages:
             return
             
-        logger.info(f"Processing Batch for Chat {chat_id} with {len(messages)} messages")
+        logger.info("Processing Batch for Chat %s with %d messages", chat_id, len(messages))
         
         # Sort by message ID
-        messages.sort(key=lambda m: m.message_id)
+        messages.sort(key=_MESSAGE_ID)
         
         # Collect content
         image_paths: List[str] = []  # 图片文件（png, jpg, gif 等）
         file_paths: List[str] = []   # 非图片文件（txt, pdf 等）
         text_parts: List[str] = []
         
-        # 图片扩展名列表
-        IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'}
-        
+        # 1. 元数据：收集文字与待下载的媒体 (index, file_id, ext, is_image)
+        #    同一文件（file_unique_id 相同，如转发/重发）在批次内只下载一次
+        downloads: List[Tuple[int, str, str, bool]] = []
+        media: List[Tuple[str, bool]] = []   # 每条媒体消息的 (去重 key, is_image)，保持原顺序
+        seen: Dict[str, int] = {}            # 去重 key -> downloads 下标
         for i, msg in enumerate(messages):
             # Text
             if msg.text:
@@ -643,48 +959,63 @@ class AntigravityBridge:
             
             # Media
             file_id = None
+            unique_id = None
             file_ext = ".png"
             is_image = True  # 默认是图片
             
             # 调试: 打印消息类型信息
-            logger.info(f"Message {i}: text={bool(msg.text)}, caption={bool(msg.caption)}, "
-                       f"photo={bool(msg.photo)}, document={bool(msg.document)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Message %d: text=%s, caption=%s, photo=%s, document=%s",
+                             i, bool(msg.text), bool(msg.caption), bool(msg.photo), bool(msg.document))
             
             if msg.photo:
                 # Photo 类型一定是图片
                 file_id = msg.photo[-1].file_id
-                logger.info(f"Found photo with file_id: {file_id[:20]}...")
+                unique_id = msg.photo[-1].file_unique_id
+                logger.info("Found photo with file_id: %.20s...", file_id)
             elif msg.document:
                 file_id = msg.document.file_id
-                logger.info(f"Found document with file_id: {file_id[:20]}...")
-                if msg.document.file_name:
-                    ext = Path(msg.document.file_name).suffix.lower()
+                unique_id = msg.document.file_unique_id
+                logger.info("Found document with file_id: %.20s...", file_id)
+                name = msg.document.file_name
+                if name:
+                    # 与 Path.suffix 语义一致（忽略 ".bashrc" 和结尾的 "."），但不构造 Path 对象
+                    dot = name.rfind('.')
+                    ext = name[dot:].lower() if 0 < dot < len(name) - 1 else ''
                     if ext:
                         file_ext = ext
                         # 判断是否为图片
                         is_image = ext in IMAGE_EXTENSIONS
-                        logger.info(f"Document extension: {ext}, is_image: {is_image}")
+                        logger.info("Document extension: %s, is_image: %s", ext, is_image)
             
             if file_id:
-                try:
-                    # Download file
-                    file = self.bot.get_file(file_id)
-                    local_path = f"/tmp/tg_batch_{chat_id}_{i}{file_ext}"
-                    file.download(local_path)
-                    
-                    if is_image:
-                        image_paths.append(local_path)
-                        logger.info(f"Downloaded image to: {local_path}")
-                    else:
-                        file_paths.append(local_path)
-                        logger.info(f"Downloaded file to: {local_path}")
-                except Exception as e:
-                    logger.error(f"Error downloading item: {e}")
+                key = unique_id or file_id
+                if key in seen:
+                    logger.info("Message %d: duplicate of an earlier file in this batch, skip download", i)
+                else:
+                    seen[key] = len(downloads)
+                    downloads.append((i, file_id, file_ext, is_image))
+                media.append((key, is_image))
+        
+        # 2. 并行下载：多个 HTTPS 往返互相重叠，总耗时约为最慢的一次
+        batch_dir: Optional[str] = None
+        if downloads:
+            batch_dir = _make_batch_dir(chat_id)
+            with ThreadPoolExecutor(max_workers=min(self.MAX_DOWNLOAD_WORKERS, len(downloads))) as executor:
+                results = list(executor.map(lambda item: self._download_one(batch_dir, item), downloads))
+            for key, is_image in media:
+                local_path = results[seen[key]]
+                if local_path is None:
+                    continue
+                if is_image:
+                    image_paths.append(local_path)
+                else:
+                    file_paths.append(local_path)
         
         full_text = "\n".join(text_parts)
         
         # 统计日志
-        logger.info(f"收集完成: {len(image_paths)} 张图片, {len(file_paths)} 个文件, 文字长度={len(full_text)}")
+        logger.info("收集完成: %d 张图片, %d 个文件, 文字长度=%d", len(image_paths), len(file_paths), len(full_text))
         
         if self.current_mode == "CLI":
             if full_text or image_paths or file_paths:
@@ -695,11 +1026,8 @@ class AntigravityBridge:
                     file_paths=file_paths,
                 )
 
-            for path in image_paths + file_paths:
-                try:
-                    os.remove(path)
-                except OSError:
-                    pass
+            if batch_dir:
+                shutil.rmtree(batch_dir, ignore_errors=True)
             return
         
         if full_text:
@@ -712,14 +1040,19 @@ class AntigravityBridge:
         
         # Process in background thread
         def process():
+            status_batcher = None
             try:
                 sender = messages[0].from_user
                 
-                def send_status(status: str):
+                def send_message(status: str):
                     try:
                         self.bot.send_message(chat_id=sender.id, text=status)
                     except Exception as e:
-                        logger.error(f"Error sending status: {e}")
+                        logger.error("Error sending status: %s", e)
+                
+                # 突发的状态消息合并发送，减少 Telegram API 调用
+                status_batcher = StatusBatcher(send_message)
+                send_status = status_batcher.push
                 
                 # Create reply_event to stop "思考中..." when MCP sends reply
                 reply_event = None
@@ -743,16 +1076,30 @@ class AntigravityBridge:
                         reply_event=reply_event,
                     )
             finally:
+                # 发送尚未合并发出的状态消息
+                if status_batcher is not None:
+                    status_batcher.flush(final=True)
+                
                 # Cleanup downloaded files
-                for path in image_paths + file_paths:
-                    try:
-                        os.remove(path)
-                    except OSError:
-                        pass
+                if batch_dir:
+                    shutil.rmtree(batch_dir, ignore_errors=True)
         
         thread = threading.Thread(target=process, daemon=True)
         thread.start()
     
+    def _download_one(self, batch_dir: str, item: Tuple[int, str, str, bool]) -> Optional[str]:
+        """下载单个 Telegram 文件到批次目录，返回本地路径；失败时返回 None。"""
+        i, file_id, file_ext, is_image = item
+        try:
+            file = self.bot.get_file(file_id)
+            local_path = os.path.join(batch_dir, f"{i}{file_ext}")
+            file.download(local_path)
+            logger.info("Downloaded %s to: %s", 'image' if is_image else 'file', local_path)
+            return local_path
+        except Exception as e:
+            logger.error("Error downloading item: %s", e)
+            return None
+    
     def send_telegram(self, chat_id_str: str, text: str) -> Optional[Exception]:
         """
         Send a message to Telegram.
@@ -762,13 +1109,16 @@ class AntigravityBridge:
         try:
             if not self.bot:
                 return Exception("Telegram Bot not initialized yet")
-            chat_id = int(chat_id_str)
+            # @channelusername 原样传给 Bot API，数字 ID 转为 int
+            chat_id: Union[int, str] = chat_id_str if chat_id_str.startswith('@') else int(chat_id_str)
             # Handle escaped newlines
             safe_text = text.replace("\\n", "\n")
-            self.bot.send_message(chat_id=chat_id, text=safe_text)
-            return None
+            error = self.telegram_sender.send(chat_id, safe_text)
+            if error:
+                logger.error("Error sending to Telegram: %s", error)
+            return error
         except Exception as e:
-            logger.error(f"Error sending to Telegram: {e}")
+            logger.error("Error sending to Telegram: %s", e)
             return e
     
     
@@ -805,7 +1155,7 @@ class AntigravityBridge:
         except Exception:
             pass
 
-        logger.info(f"Running mode: {'MCP' if is_mcp else 'Daemon'}")
+        logger.info("Running mode: %s", 'MCP' if is_mcp else 'Daemon')
         
         if not is_mcp:
             # 使用 PID 文件确保只有一个 Daemon 实例在运行（避免 Telegram polling 冲突）
@@ -825,22 +1175,27 @@ class AntigravityBridge:
                                         cmdline = f.read().decode('utf-8', errors='ignore').replace('\x00', ' ')
                                     if 'antigravity' in cmdline.lower() or 'main.py' in cmdline.lower():
                                         os.kill(old_pid, 9)
-                                        logger.info(f"已清理旧的后台 Daemon 进程: PID {old_pid}")
+                                        logger.info("已清理旧的后台 Daemon 进程: PID %s", old_pid)
                             except ProcessLookupError:
                                 pass
                             except Exception as e:
-                                logger.debug(f"检查/清理旧进程时出错: {e}")
+                                logger.debug("检查/清理旧进程时出错: %s", e)
                 
                 # 写入当前 PID
                 with open(pid_file, 'w') as f:
                     f.write(str(current_pid))
             except Exception as e:
-                logger.error(f"PID 文件处理出错: {e}")
+                logger.error("PID 文件处理出错: %s", e)
+            # 后台预热 GUI 自动化（X 连接、OpenCV、模板解码），不阻塞启动
+            threading.Thread(
+                target=warm_up, args=(self.templates_dir,), name="gui-warmup", daemon=True
+            ).start()
+            
             # Start bot in background (Service Binary w/ Polling)
             try:
                 self.updater.start_polling()
             except Exception as e:
-                logger.critical(f"Failed to start polling: {e}")
+                logger.critical("Failed to start polling: %s", e)
                 if "Unauthorized" in str(e) or "InvalidToken" in str(e):
                     logger.critical("FATAL: The provided Telegram Token is invalid. Please check your .env file.")
         else:
@@ -864,13 +1219,15 @@ class AntigravityBridge:
         self._shutting_down = True
         logger.info("Shutting down...")
 
+        self.batch_scheduler.stop()
+
         if hasattr(self, 'updater'):
             try:
                 self.updater.stop()
             except KeyboardInterrupt:
                 logger.warning("Interrupted while stopping updater; continuing shutdown.")
             except Exception as e:
-                logger.error(f"Error while stopping updater: {e}")
+                logger.error("Error while stopping updater: %s", e)
 
         if hasattr(self, 'cli_bridge') and self.cli_bridge:
             try:
@@ -878,7 +1235,7 @@ class AntigravityBridge:
             except KeyboardInterrupt:
                 logger.warning("Interrupted while stopping CLI bridge; continuing shutdown.")
             except Exception as e:
-                logger.error(f"Error while stopping CLI bridge: {e}")
+                logger.error("Error while stopping CLI bridge: %s", e)
 
 
 
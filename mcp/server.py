@@ -8,19 +8,53 @@ Supports: initialize, tools/list, tools/call methods.
 import json
 import logging
 import os
+import queue
+import re
 import sys
 import threading
-from typing import Any, Callable, Dict, Optional
+import types
+from typing import Any, Callable, Dict, Mapping, Optional
+
+try:
+    import orjson  # 可选：更快的 JSON 编解码
+except ImportError:
+    orjson = None
 
 # Configure logging to stderr (stdout is for MCP protocol)
+# 默认 INFO，排查问题时可设置 AG_LOGLEVEL=DEBUG
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv('AG_LOGLEVEL', 'INFO').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s',
     stream=sys.stderr
 )
 logger = logging.getLogger(__name__)
 
 
+# 缺省 params / arguments 共用的只读空映射，避免每个请求分配一个新 dict
+_EMPTY = types.MappingProxyType({})
+
+# reply_to_telegram 参数校验：数字 chat_id（可带负号，群组/频道）或 @频道用户名，文本不超过 Telegram 单条上限
+_CHAT_ID_RE = re.compile(r'-?\d{1,20}|@[A-Za-z0-9_]{5,32}')
+_MAX_TELEGRAM_TEXT_LENGTH = 4096
+
+# 所有响应共同的开头，后面紧跟序列化后的 id
+_RESPONSE_PREFIX = b'{"jsonrpc":"2.0","id":'
+
+
+def _json_loads(data: bytes) -> Any:
+    """解析一行 JSON-RPC 消息（bytes），优先使用 orjson。"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """序列化为 UTF-8 JSON bytes，优先使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
 class MCPServer:
     """
     Minimal MCP Protocol server implementation.
@@ -31,6 +65,58 @@ class MCPServer:
     # 使用文件共享 last_chat_id（解决进程间通信问题）
     LAST_CHAT_ID_FILE = "/tmp/antigravity_last_chat_id"
     
+    # 固定不变的响应结果，只在初始化时序列化一次
+    # 严格按照 MCP 协议规范返回
+    _INITIALIZE_RESULT = {
+        'protocolVersion': '2024-11-05',
+        'capabilities': {
+            'tools': {
+                'listChanged': False  # 明确声明不支持动态工具列表变更通知
+            },
+        },
+        'serverInfo': {
+            'name': 'antigravity-bridge',
+            'version': '2.0.0',
+        },
+    }
+    
+    _TOOLS_LIST_RESULT = {
+        'tools': [
+            {
+                'name': 'reply_to_telegram',
+                'description': 'Send a message reply to a Telegram Chat ID',
+                'inputSchema': {
+                    'type': 'object',
+                    'properties': {
+                        'chat_id': {
+                            'type': 'string',
+                            'description': 'The Telegram Chat ID to reply to (optional, uses last message sender if not provided)',
+                        },
+                        'text': {
+                            'type': 'string',
+                            'description': 'The content of the message',
+                        },
+                    },
+                    'required': ['text'],
+                },
+            },
+        ],
+    }
+    
+    _STATIC_RESULTS = {
+        'initialize': _INITIALIZE_RESULT,
+        'tools/list': _TOOLS_LIST_RESULT,
+        'ping': {},  # 支持 ping 请求（协议要求）
+    }
+    
+    # 单个 JSON-RPC 帧（一行）的长度上限，超出的帧整体丢弃，避免无限制占用内存
+    MAX_FRAME_SIZE = 1 << 20
+    
+    # 请求队列上限：客户端发送过快时 stdin 读取会阻塞（背压）
+    REQUEST_QUEUE_SIZE = 1024
+    # 工作线程数：reply_to_telegram 会阻塞在网络上，至少保留 4 个，避免 ping 等请求排队
+    WORKER_COUNT = max(4, os.cpu_count() or 1)
+    
     def __init__(self, telegram_func: Optional[Callable[[str, str], Optional[Exception]]] = None,
                  stdout_stream=None):
         """
@@ -43,21 +129,38 @@ class MCPServer:
                           If None, uses sys.stdout.
         """
         self.telegram_func = telegram_func
-        self._output_lock = threading.Lock()
+        # 所有响应经由单一写线程输出，工作线程只需入队，不再争用输出锁
+        self._output_queue: "queue.Queue[bytes]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
         # Use provided stdout or fall back to sys.stdout
         self._stdout = stdout_stream if stdout_stream is not None else sys.stdout
         # Reply event: set when reply_to_telegram succeeds, used to stop "思考中..." loop
         self._reply_event: Optional[threading.Event] = None
         self._reply_event_lock = threading.Lock()
+        # 固定数量的工作线程从队列取请求处理，不再每个请求新建线程
+        self._request_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=self.REQUEST_QUEUE_SIZE)
+        self._workers: list = []
+        # 预先拼好 id 之后的整段响应尾部，热路径只需拼接 id
+        self._static_bodies: Dict[str, bytes] = {
+            method: b',"result":' + _json_dumps(result) + b'}'
+            for method, result in self._STATIC_RESULTS.items()
+        }
+        # 方法名 / 工具名 -> 处理函数，一次哈希查找代替 if/elif 链
+        self._methods: Dict[str, Callable[[Mapping[str, Any]], Dict[str, Any]]] = {
+            'tools/call': self._on_tools_call,
+        }
+        self._tools: Dict[str, Callable[[Mapping[str, Any]], Dict[str, Any]]] = {
+            'reply_to_telegram': self._tool_reply_to_telegram,
+        }
     
     def set_last_chat_id(self, chat_id: str):
         """设置最后收到消息的 chat_id，写入文件供其他进程读取。"""
         try:
             with open(self.LAST_CHAT_ID_FILE, 'w') as f:
                 f.write(chat_id)
-            logger.debug(f"MCP: last_chat_id set to {chat_id}")
+            logger.debug("MCP: last_chat_id set to %s", chat_id)
         except Exception as e:
-            logger.error(f"MCP: Error writing last_chat_id: {e}")
+            logger.error("MCP: Error writing last_chat_id: %s", e)
     
     def get_last_chat_id(self) -> Optional[str]:
         """从文件读取最后的 chat_id。"""
@@ -66,7 +169,7 @@ class MCPServer:
                 with open(self.LAST_CHAT_ID_FILE, 'r') as f:
                     return f.read().strip()
         except Exception as e:
-            logger.error(f"MCP: Error reading last_chat_id: {e}")
+            logger.error("MCP: Error reading last_chat_id: %s", e)
         return None
     
     def create_reply_event(self) -> threading.Event:
@@ -83,142 +186,113 @@ class MCPServer:
         All logs MUST go to stderr because stdout is used for protocol.
         """
         logger.info("MCP Server starting on stdio...")
+        self._start_workers()
         
-        for line in sys.stdin:
-            line = line.strip()
-            if not line:
-                continue
-                
+        # 直接 os.read 原始字节并按 b'\n' 切分，跳过 TextIOWrapper 的解码与行缓冲
+        fd = sys.stdin.fileno()
+        buf = bytearray()
+        discarding = False  # 正在跳过一个超长帧的剩余部分（直到下一个换行符）
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            buf += chunk
+            # 只移动起始偏移扫描各行，每个 chunk 最后统一删除已消费部分，避免每行复制剩余缓冲区
+            start = 0
+            while (nl := buf.find(b'\n', start)) != -1:
+                if discarding:
+                    discarding = False
+                elif nl - start > self.MAX_FRAME_SIZE:
+                    logger.warning("MCP: Dropped oversize frame (%d bytes)", nl - start)
+                else:
+                    self._dispatch_line(bytes(buf[start:nl]))
+                start = nl + 1
+            if start:
+                del buf[:start]
+            if len(buf) > self.MAX_FRAME_SIZE:
+                # 超长且仍未出现换行：不再继续缓存，丢弃到下一个换行符为止
+                if not discarding:
+                    logger.warning("MCP: Dropping oversize frame (> %d bytes)", self.MAX_FRAME_SIZE)
+                    discarding = True
+                buf.clear()
+        
+        # EOF 时处理没有换行结尾的最后一行
+        if buf and not discarding:
+            self._dispatch_line(bytes(buf))
+    
+    def _dispatch_line(self, line: bytes):
+        """解析一行请求并放入工作队列。"""
+        line = line.strip()
+        if not line:
+            return
+        # 通知无需响应：紧凑格式且不含 "id" 的 notifications/* 直接丢弃，不做 JSON 解析
+        # （字符串值里的引号会被转义，这两个子串只可能来自真实的键）
+        if b'"method":"notifications/' in line and b'"id"' not in line:
+            return
+        try:
+            request = _json_loads(line)
+        except ValueError as e:  # json.JSONDecodeError / orjson.JSONDecodeError
+            logger.error("MCP: Error parsing JSON: %s", e)
+            return
+        # Handle request in the worker pool
+        self._request_queue.put(request)
+    
+    def _start_workers(self):
+        """启动写线程和固定数量的请求处理线程（只启动一次）。"""
+        if self._workers:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name="mcp-writer", daemon=True)
+        self._writer.start()
+        for i in range(self.WORKER_COUNT):
+            worker = threading.Thread(target=self._worker_loop, name=f"mcp-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+    
+    def _worker_loop(self):
+        """工作线程：循环从队列取出请求并处理。"""
+        while True:
+            request = self._request_queue.get()
             try:
-                request = json.loads(line)
-                # Handle request in a thread
-                thread = threading.Thread(
-                    target=self._handle_request,
-                    args=(request,),
-                    daemon=True
-                )
-                thread.start()
-            except json.JSONDecodeError as e:
-                logger.error(f"MCP: Error parsing JSON: {e}")
-                continue
+                self._handle_request(request)
+            except Exception as e:
+                logger.error("MCP: Unhandled error in worker: %s", e)
+            finally:
+                self._request_queue.task_done()
     
     def _handle_request(self, request: Dict[str, Any]):
         """Handle a single JSON-RPC request."""
         method = request.get('method', '')
         request_id = request.get('id')
-        # 确保 params 始终是字典（修复 params: null 的情况）
-        params = request.get('params') or {}
-        
-        # 详细日志记录收到的请求
-        logger.debug(f"MCP Request: method={method}, id={request_id}, params={params}")
         
         # JSON-RPC 2.0: 通知（Notification）没有 id 字段，不应返回任何响应
         # MCP 协议: 所有 notifications/ 开头的方法都是通知
+        # 放在最前面，通知不再读取 params 或记录请求详情
         if request_id is None or method.startswith('notifications/'):
             # 这是一个通知，直接忽略，不返回任何响应
-            logger.debug(f"MCP: Ignoring notification: {method}")
+            logger.debug("MCP: Ignoring notification: %s", method)
             return
         
+        # 确保 params 始终是映射（修复 params: null 的情况）
+        params = request.get('params') or _EMPTY
+        
+        # 详细日志记录收到的请求
+        logger.debug("MCP Request: method=%s, id=%s, params=%s", method, request_id, params)
+        
         response: Dict[str, Any] = {
             'jsonrpc': '2.0',
             'id': request_id
         }
         
         try:
-            if method == 'initialize':
-                # 严格按照 MCP 协议规范返回
-                response['result'] = {
-                    'protocolVersion': '2024-11-05',
-                    'capabilities': {
-                        'tools': {
-                            'listChanged': False  # 明确声明不支持动态工具列表变更通知
-                        },
-                    },
-                    'serverInfo': {
-                        'name': 'antigravity-bridge',
-                        'version': '2.0.0',
-                    },
-                }
+            body = self._static_bodies.get(method)
+            if body is not None:
+                # initialize / tools/list / ping 的结果是固定的，直接拼接预序列化好的字节
+                self._write_output(_RESPONSE_PREFIX + _json_dumps(request_id) + body)
+                return
             
-            elif method == 'ping':
-                # 支持 ping 请求（协议要求）
-                response['result'] = {}
-                
-            elif method == 'tools/list':
-                response['result'] = {
-                    'tools': [
-                        {
-                            'name': 'reply_to_telegram',
-                            'description': 'Send a message reply to a Telegram Chat ID',
-                            'inputSchema': {
-                                'type': 'object',
-                                'properties': {
-                                    'chat_id': {
-                                        'type': 'string',
-                                        'description': 'The Telegram Chat ID to reply to (optional, uses last message sender if not provided)',
-                                    },
-                                    'text': {
-                                        'type': 'string',
-                                        'description': 'The content of the message',
-                                    },
-                                },
-                                'required': ['text'],
-                            },
-                        },
-                    ],
-                }
-                
-            elif method == 'tools/call':
-                tool_name = params.get('name', '')
-                arguments = params.get('arguments', {})
-                
-                if tool_name == 'reply_to_telegram':
-                    chat_id = arguments.get('chat_id', '') or self.get_last_chat_id() or ''
-                    text = arguments.get('text', '')
-                    
-                    if not chat_id:
-                        response['error'] = {
-                            'code': -32602,
-                            'message': 'chat_id is required (no last_chat_id available)',
-                        }
-                    elif not text:
-                        response['error'] = {
-                            'code': -32602,
-                            'message': 'text is required',
-                        }
-                    elif self.telegram_func:
-                        logger.info(f"MCP: Calling reply_to_telegram({chat_id}, {text[:50]}...)")
-                        error = self.telegram_func(chat_id, text)
-                        if error:
-                            response['error'] = {
-                                'code': -32000,
-                                'message': f'Telegram Error: {error}',
-                            }
-                        else:
-                            # Signal monitoring loop to stop sending "思考中..."
-                            with self._reply_event_lock:
-                                if self._reply_event:
-                                    self._reply_event.set()
-                                    logger.info("MCP: reply_event set, stopping thinking heartbeat")
-                            response['result'] = {
-                                'content': [
-                                    {
-                                        'type': 'text',
-                                        'text': 'Message sent successfully',
-                                    },
-                                ],
-                            }
-                    else:
-                        response['error'] = {
-                            'code': -32000,
-                            'message': 'Telegram function not initialized',
-                        }
-                else:
-                    response['error'] = {
-                        'code': -32601,
-                        'message': 'Tool not found',
-                    }
-                    
+            handler = self._methods.get(method)
+            if handler is not None:
+                response.update(handler(params))
             else:
                 response['error'] = {
                     'code': -32601,
@@ -226,17 +300,125 @@ class MCPServer:
                 }
                 
         except Exception as e:
-            logger.error(f"MCP: Error handling request: {e}")
+            logger.error("MCP: Error handling request: %s", e)
             response['error'] = {
                 'code': -32603,
                 'message': f'Internal error: {str(e)}',
             }
         
         # Send response
-        self._write_output(json.dumps(response))
+        self._write_output(_json_dumps(response))
+    
+    def _on_tools_call(self, params: Mapping[str, Any]) -> Dict[str, Any]:
+        """按工具名分发 tools/call。"""
+        tool = self._tools.get(params.get('name', ''))
+        if tool is None:
+            return {
+                'error': {
+                    'code': -32601,
+                    'message': 'Tool not found',
+                },
+            }
+        return tool(params.get('arguments') or _EMPTY)
     
-    def _write_output(self, message: str):
-        """Thread-safe write to stdout."""
-        with self._output_lock:
-            self._stdout.write(message + '\n')
-            self._stdout.flush()
+    def _tool_reply_to_telegram(self, arguments: Mapping[str, Any]) -> Dict[str, Any]:
+        """reply_to_telegram 工具：发送消息到 Telegram。"""
+        chat_id = str(arguments.get('chat_id', '') or self.get_last_chat_id() or '')
+        text = arguments.get('text', '')
+        
+        # 在发起 HTTPS 请求之前拦截必然失败的参数，省去一次往返
+        if not chat_id:
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': 'chat_id is required (no last_chat_id available)',
+                },
+            }
+        if not _CHAT_ID_RE.fullmatch(chat_id):
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': f'invalid chat_id: {chat_id}',
+                },
+            }
+        if not text or not isinstance(text, str):
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': 'text is required',
+                },
+            }
+        if len(text) > _MAX_TELEGRAM_TEXT_LENGTH:
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': f'text is too long ({len(text)} > {_MAX_TELEGRAM_TEXT_LENGTH} characters)',
+                },
+            }
+        if not self.telegram_func:
+            return {
+                'error': {
+                    'code': -32000,
+                    'message': 'Telegram function not initialized',
+                },
+            }
+        
+        logger.info("MCP: Calling reply_to_telegram(%s, %.50s...)", chat_id, text)
+        error = self.telegram_func(chat_id, text)
+        if error:
+            return {
+                'error': {
+                    'code': -32000,
+                    'message': f'Telegram Error: {error}',
+                },
+            }
+        
+        # Signal monitoring loop to stop sending "思考中..."
+        with self._reply_event_lock:
+            if self._reply_event:
+                self._reply_event.set()
+                logger.info("MCP: reply_event set, stopping thinking heartbeat")
+        return {
+            'result': {
+                'content': [
+                    {
+                        'type': 'text',
+                        'text': 'Message sent successfully',
+                    },
+                ],
+            },
+        }
+    
+    def _write_output(self, message: bytes):
+        """Queue one JSON line for the writer thread."""
+        self._output_queue.put(message)
+    
+    def _writer_loop(self):
+        """写线程：取出所有已排队的响应，拼入复用的缓冲区后一次 write + flush。"""
+        scratch = bytearray()
+        while True:
+            lines = [self._output_queue.get()]
+            while True:
+                try:
+                    lines.append(self._output_queue.get_nowait())
+                except queue.Empty:
+                    break
+            scratch.clear()
+            for line in lines:
+                scratch += line
+                scratch += b'\n'
+            try:
+                out = getattr(self._stdout, 'buffer', None)
+                if out is not None:
+                    # 文本层可能还有未刷出的内容，先刷新再写底层二进制流
+                    self._stdout.flush()
+                    out.write(scratch)
+                    out.flush()
+                else:
+                    self._stdout.write(scratch.decode('utf-8'))
+                    self._stdout.flush()
+            except Exception as e:
+                logger.error("MCP: Error writing output: %s", e)
+            finally:
+                for _ in lines:
+                    self._output_queue.task_done()
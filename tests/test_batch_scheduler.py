@@ -0,0 +1,100 @@
+"""BatchScheduler 静默期去抖：同一 key 只触发最后一次，不同 key 互不阻塞。"""
+import sys
+import threading
+import time
+
+import pytest
+
+# main 导入时会把 sys.stdout 重定向到 stderr（为 MCP 保留 stdout），测试中恢复
+_stdout = sys.stdout
+main = pytest.importorskip("main")
+sys.stdout = _stdout
+
+DELAY = 0.05
+
+
+class Recorder:
+    """记录回调收到的 key，并可等待达到指定次数。"""
+
+    def __init__(self):
+        self.keys = []
+        self._cond = threading.Condition()
+
+    def __call__(self, key):
+        with self._cond:
+            self.keys.append(key)
+            self._cond.notify_all()
+
+    def wait_for(self, count, timeout=2.0):
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.keys) >= count, timeout)
+
+
+@pytest.fixture
+def fired():
+    return Recorder()
+
+
+@pytest.fixture
+def scheduler(fired):
+    s = main.BatchScheduler(fired, delay=DELAY)
+    yield s
+    s.stop()
+
+
+def test_repeated_schedule_fires_once_after_quiescence(scheduler, fired):
+    start = time.monotonic()
+    for _ in range(5):
+        scheduler.schedule(1)
+        time.sleep(DELAY / 5)
+    assert fired.wait_for(1)
+    # 最后一次 schedule 之后还要再静默 DELAY 秒才触发
+    assert time.monotonic() - start >= DELAY * 1.8
+    time.sleep(DELAY * 2)
+    assert fired.keys == [1]
+
+
+def test_keys_are_debounced_independently(scheduler, fired):
+    scheduler.schedule(1)
+    scheduler.schedule(2, delay=DELAY * 4)
+    scheduler.schedule(3, delay=0)
+    assert fired.wait_for(3)
+    assert fired.keys == [3, 1, 2]
+
+
+def test_key_can_be_rescheduled_after_firing(scheduler, fired):
+    scheduler.schedule(7, delay=0)
+    assert fired.wait_for(1)
+    scheduler.schedule(7, delay=0)
+    assert fired.wait_for(2)
+    assert fired.keys == [7, 7]
+
+
+def test_stop_discards_pending_keys(scheduler, fired):
+    scheduler.schedule(1)
+    scheduler.stop()
+    time.sleep(DELAY * 3)
+    assert fired.keys == []
+
+
+def test_slow_callback_does_not_block_other_keys():
+    release = threading.Event()
+    fired = []
+    second = threading.Event()
+
+    def callback(key):
+        fired.append(key)
+        if key == 1:
+            release.wait(2.0)
+        else:
+            second.set()
+
+    s = main.BatchScheduler(callback, delay=0)
+    try:
+        s.schedule(1)
+        s.schedule(2, delay=DELAY)
+        assert second.wait(1.0)
+        assert fired == [1, 2]
+    finally:
+        release.set()
+        s.stop()
@@ -0,0 +1,66 @@
+"""_best_match 金字塔匹配不应比原分辨率全图匹配漏检（使用仓库内真实模板）。"""
+import os
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from automation import gui_automation as g
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(ROOT, "templates")
+CONFIDENCE = 0.8
+
+
+def _gray(path):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    assert image is not None, path
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+@pytest.fixture(scope="module")
+def background():
+    return _gray(os.path.join(ROOT, "failed_find_panel.png"))
+
+
+def _paste(background, template, x, y):
+    hay = background.copy()
+    h, w = template.shape
+    hay[y:y + h, x:x + w] = template
+    return hay
+
+
+def _assert_no_miss(hay, template):
+    full, _ = g._full_match(hay, template)
+    score, _ = g._best_match(hay, template, CONFIDENCE)
+    if full >= CONFIDENCE:
+        assert score >= CONFIDENCE, f"pyramid score {score:.2f} < full-resolution {full:.2f}"
+
+
+# 旧实现在这些位置细化后分数只有 0.40 / 0.48，全图匹配却能命中
+@pytest.mark.parametrize("name, x, y", [
+    ("panel-ClaudeOpus.png", 539, 13),
+    ("panel-Gemini.png", 301, 237),
+    ("panel-Gemini.png", 1343, 145),
+])
+def test_pyramid_falls_back_on_known_misses(background, name, x, y):
+    template = _gray(os.path.join(TEMPLATES_DIR, name))
+    assert g._pyramid_levels(background, template) > 0
+    _assert_no_miss(_paste(background, template, x, y), template)
+
+
+@pytest.mark.parametrize("name", sorted(
+    n for n in os.listdir(TEMPLATES_DIR) if n.lower().endswith(".png")
+))
+def test_pyramid_matches_full_resolution(background, name):
+    template = _gray(os.path.join(TEMPLATES_DIR, name))
+    h, w = template.shape
+    height, width = background.shape
+    if h >= height or w >= width:
+        pytest.skip("template larger than background")
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        x = int(rng.integers(0, width - w))
+        y = int(rng.integers(0, height - h))
+        _assert_no_miss(_paste(background, template, x, y), template)
@@ -0,0 +1,277 @@
+"""MCPServer：reply_to_telegram 参数校验、工作线程池、stdin 分帧与超长帧丢弃、写线程。"""
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from mcp.server import MCPServer
+
+FAKE_FD = -100
+
+
+class FakeStdout:
+    """文本输出流替身：记录每次 write，并可等待指定 id 的响应。"""
+
+    def __init__(self):
+        self.writes = []
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        with self._cond:
+            self.writes.append(data)
+            self._cond.notify_all()
+
+    def flush(self):
+        pass
+
+    def responses(self):
+        with self._cond:
+            text = "".join(self.writes)
+        return [json.loads(line) for line in text.splitlines()]
+
+    def wait_for_id(self, request_id, timeout=2.0):
+        def find():
+            return next((r for r in self.responses() if r.get('id') == request_id), None)
+        with self._cond:
+            self._cond.wait_for(lambda: find() is not None, timeout)
+        return find()
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def server(sent):
+    def telegram_func(chat_id, text):
+        sent.append((chat_id, text))
+        return None
+    return MCPServer(telegram_func)
+
+
+@pytest.mark.parametrize("chat_id", ["123456789", "-1001234567890", "@my_channel"])
+def test_valid_chat_id_is_passed_through(server, sent, chat_id):
+    response = server._tool_reply_to_telegram({'chat_id': chat_id, 'text': 'hi'})
+    assert 'result' in response
+    assert sent == [(chat_id, 'hi')]
+
+
+@pytest.mark.parametrize("chat_id", ["@abc", "12ab", "@bad-name", "1" * 21])
+def test_invalid_chat_id_is_rejected(server, sent, chat_id):
+    response = server._tool_reply_to_telegram({'chat_id': chat_id, 'text': 'hi'})
+    assert response['error']['code'] == -32602
+    assert sent == []
+
+
+def test_too_long_text_is_rejected(server, sent):
+    response = server._tool_reply_to_telegram({'chat_id': '@my_channel', 'text': 'x' * 4097})
+    assert response['error']['code'] == -32602
+    assert sent == []
+
+
+class RecordingBuffer(io.BytesIO):
+    """记录每次 write 的字节流。"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+        return super().write(data)
+
+
+class FakeBinaryStdout(FakeStdout):
+    """带 buffer 属性的输出流替身，写线程应直接写入底层字节流。"""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = RecordingBuffer()
+
+
+class FakeStdin:
+    """只提供 fileno()，配合 fake_read 按给定的分块返回数据，之后返回 EOF。"""
+
+    def fileno(self):
+        return FAKE_FD
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    """把 sys.stdin 换成假 fd，用给定分块运行 start()，返回按顺序入队的请求。"""
+    real_read = os.read
+
+    def run(server, chunks):
+        pending = list(chunks)
+
+        def fake_read(fd, size):
+            if fd != FAKE_FD:
+                return real_read(fd, size)
+            return pending.pop(0) if pending else b''
+
+        monkeypatch.setattr(os, 'read', fake_read)
+        monkeypatch.setattr('sys.stdin', FakeStdin())
+        monkeypatch.setattr(server, '_start_workers', lambda: None)
+        server.start()
+        requests = []
+        while not server._request_queue.empty():
+            requests.append(server._request_queue.get_nowait())
+        return requests
+
+    return run
+
+
+def _request(request_id, method, params=None):
+    request = {'jsonrpc': '2.0', 'id': request_id, 'method': method}
+    if params is not None:
+        request['params'] = params
+    return request
+
+
+def test_ping_is_answered_while_a_reply_blocks():
+    release = threading.Event()
+    stdout = FakeStdout()
+
+    def telegram_func(chat_id, text):
+        release.wait(2.0)
+        return None
+
+    server = MCPServer(telegram_func, stdout_stream=stdout)
+    server._start_workers()
+    server._request_queue.put(_request(1, 'tools/call', {
+        'name': 'reply_to_telegram',
+        'arguments': {'chat_id': '123', 'text': 'hi'},
+    }))
+    server._request_queue.put(_request(2, 'ping'))
+    try:
+        assert stdout.wait_for_id(2) == {'jsonrpc': '2.0', 'id': 2, 'result': {}}
+        assert all(r['id'] != 1 for r in stdout.responses())
+    finally:
+        release.set()
+    assert 'result' in stdout.wait_for_id(1)
+
+
+def test_workers_are_started_once():
+    server = MCPServer(stdout_stream=FakeStdout())
+    server._start_workers()
+    server._start_workers()
+    assert len(server._workers) == MCPServer.WORKER_COUNT
+    assert all(worker.is_alive() for worker in server._workers)
+
+
+def test_worker_survives_a_failing_request(monkeypatch):
+    stdout = FakeStdout()
+    server = MCPServer(stdout_stream=stdout)
+    handle = server._handle_request
+
+    def flaky(request):
+        if request['id'] == 1:
+            raise RuntimeError("boom")
+        handle(request)
+
+    monkeypatch.setattr(server, '_handle_request', flaky)
+    monkeypatch.setattr(MCPServer, 'WORKER_COUNT', 1)
+    server._start_workers()
+    server._request_queue.put(_request(1, 'ping'))
+    server._request_queue.put(_request(2, 'ping'))
+    assert stdout.wait_for_id(2) is not None
+    server._request_queue.join()
+
+
+def test_lines_split_across_reads_are_reassembled(feed):
+    server = MCPServer(stdout_stream=FakeStdout())
+    chunks = [b'{"id":1,', b'"method":"ping"}\n{"id"', b':2,"method":"ping"}\r\n\n', b'{"id":3,"method":"ping"}\n']
+    assert [r['id'] for r in feed(server, chunks)] == [1, 2, 3]
+
+
+def test_several_lines_in_one_read(feed):
+    server = MCPServer(stdout_stream=FakeStdout())
+    chunk = b''.join(b'{"id":%d,"method":"ping"}\n' % i for i in range(5))
+    assert [r['id'] for r in feed(server, [chunk])] == list(range(5))
+
+
+def test_unterminated_last_line_is_dispatched_at_eof(feed):
+    server = MCPServer(stdout_stream=FakeStdout())
+    chunks = [b'{"id":1,"method":"ping"}\n{"id":2,', b'"method":"ping"}']
+    assert [r['id'] for r in feed(server, chunks)] == [1, 2]
+
+
+def test_notifications_and_bad_json_are_not_queued(feed):
+    server = MCPServer(stdout_stream=FakeStdout())
+    chunks = [b'{"jsonrpc":"2.0","method":"notifications/initialized"}\n', b'not json\n{"id":1,"method":"ping"}\n']
+    assert [r['id'] for r in feed(server, chunks)] == [1]
+
+
+def test_writer_drains_queued_responses_in_one_write():
+    stdout = FakeStdout()
+    server = MCPServer(stdout_stream=stdout)
+    for i in range(3):
+        server._write_output(b'{"id":%d}' % i)
+    server._start_workers()
+    server._output_queue.join()
+    assert stdout.writes == ['{"id":0}\n{"id":1}\n{"id":2}\n']
+
+
+def test_writer_uses_the_binary_buffer_when_available():
+    stdout = FakeBinaryStdout()
+    server = MCPServer(stdout_stream=stdout)
+    server._write_output(b'{"id":1}')
+    server._write_output('{"text":"思考中"}'.encode('utf-8'))
+    server._start_workers()
+    server._output_queue.join()
+    assert stdout.writes == []
+    assert stdout.buffer.writes == ['{"id":1}\n{"text":"思考中"}\n'.encode('utf-8')]
+
+
+def test_writer_keeps_running_after_a_write_error():
+    class BrokenOnce(FakeStdout):
+        failed = False
+
+        def write(self, data):
+            if not self.failed:
+                self.failed = True
+                raise OSError("EPIPE")
+            super().write(data)
+
+    stdout = BrokenOnce()
+    server = MCPServer(stdout_stream=stdout)
+    server._start_workers()
+    server._write_output(b'{"id":1}')
+    server._output_queue.join()
+    server._write_output(b'{"id":2}')
+    server._output_queue.join()
+    assert stdout.writes == ['{"id":2}\n']
+
+
+PING = b'{"id":%d,"method":"ping"}'
+
+
+@pytest.fixture
+def small_frames(monkeypatch):
+    server = MCPServer(stdout_stream=FakeStdout())
+    monkeypatch.setattr(server, 'MAX_FRAME_SIZE', len(PING % 1))
+    return server
+
+
+def test_frame_at_the_limit_is_accepted(feed, small_frames):
+    assert [r['id'] for r in feed(small_frames, [PING % 1 + b'\n'])] == [1]
+
+
+def test_oversize_line_within_one_read_is_dropped(feed, small_frames):
+    chunk = PING % 1 + b'\n' + PING % 1000 + b'\n' + PING % 2 + b'\n'
+    assert [r['id'] for r in feed(small_frames, [chunk])] == [1, 2]
+
+
+def test_oversize_frame_is_discarded_up_to_the_next_newline(feed, small_frames):
+    # 超长帧跨多次读取且迟迟没有换行：缓冲区超限后进入丢弃模式，直到下一个换行符；
+    # 帧的剩余部分即使本身是合法 JSON 也不能被当作一个请求
+    chunks = [PING % 1 + b'\n{"id":9,"pad":"' + b'x' * 64, b'x' * 64, PING % 8 + b'\n' + PING % 2 + b'\n']
+    assert [r['id'] for r in feed(small_frames, chunks)] == [1, 2]
+
+
+def test_oversize_tail_at_eof_is_dropped(feed, small_frames):
+    chunks = [PING % 1 + b'\n{"id":9,"pad":"' + b'x' * 64, PING % 8]
+    assert [r['id'] for r in feed(small_frames, chunks)] == [1]
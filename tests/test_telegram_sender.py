@@ -0,0 +1,129 @@
+"""TelegramSender：同一 chat 的突发消息合并、4096 字符拆分、令牌桶限速。"""
+import sys
+import threading
+import time
+
+import pytest
+
+# main 导入时会把 sys.stdout 重定向到 stderr（为 MCP 保留 stdout），测试中恢复
+_stdout = sys.stdout
+main = pytest.importorskip("main")
+sys.stdout = _stdout
+
+
+class FakeBot:
+    """只实现 send_message，记录每次调用及其时间。"""
+
+    def __init__(self, error=None):
+        self.sent = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text):
+        with self._lock:
+            self.sent.append((chat_id, text, time.monotonic()))
+        if self.error is not None:
+            raise self.error
+
+
+def _sender(bot, **kwargs):
+    return main.TelegramSender(lambda chat_id, text: bot.send_message(chat_id=chat_id, text=text), **kwargs)
+
+
+def _send_concurrently(sender, messages):
+    """每条消息一个线程同时调用 send()，返回各自的结果。"""
+    results = [None] * len(messages)
+    barrier = threading.Barrier(len(messages))
+
+    def run(i, chat_id, text):
+        barrier.wait()
+        results[i] = sender.send(chat_id, text)
+
+    threads = [threading.Thread(target=run, args=(i, c, t)) for i, (c, t) in enumerate(messages)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5.0)
+    return results
+
+
+def _items(*pairs):
+    return [main.OutgoingMessage(chat_id, text) for chat_id, text in pairs]
+
+
+def test_single_message_is_sent_as_is():
+    bot = FakeBot()
+    assert _sender(bot).send(1, "hello") is None
+    assert [(c, t) for c, t, _ in bot.sent] == [(1, "hello")]
+
+
+def test_burst_to_one_chat_is_merged_within_the_window():
+    bot = FakeBot()
+    sender = _sender(bot, window=0.2)
+    results = _send_concurrently(sender, [(1, "a"), (1, "b"), (1, "c")])
+    assert results == [None, None, None]
+    assert len(bot.sent) == 1
+    chat_id, text, _ = bot.sent[0]
+    assert chat_id == 1
+    assert sorted(text.split("\n\n")) == ["a", "b", "c"]
+
+
+def test_send_error_is_returned_to_every_merged_caller():
+    error = RuntimeError("Flood control exceeded")
+    bot = FakeBot(error=error)
+    sender = _sender(bot, window=0.2)
+    assert _send_concurrently(sender, [(1, "a"), (1, "b")]) == [error, error]
+
+
+def test_group_keeps_chats_apart_and_in_order():
+    sender = _sender(FakeBot())
+    groups = sender._group(_items((1, "a"), (2, "x"), (1, "b"), ("@chan", "y")))
+    assert [[(i.chat_id, i.text) for i in g] for g in groups] == [
+        [(1, "a"), (1, "b")], [(2, "x")], [("@chan", "y")],
+    ]
+
+
+def test_group_merges_up_to_exactly_max_length():
+    sender = _sender(FakeBot())
+    groups = sender._group(_items((1, "a" * 2047), (1, "b" * 2047)))
+    assert len(groups) == 1
+    assert len("\n\n".join(i.text for i in groups[0])) == 4096
+
+
+def test_group_splits_a_merge_that_would_exceed_max_length():
+    sender = _sender(FakeBot())
+    groups = sender._group(_items((1, "a" * 3000), (1, "b" * 1096), (1, "c"), (1, "d")))
+    texts = ["\n\n".join(i.text for i in g) for g in groups]
+    assert [len(t) for t in texts] == [3000, 1096 + 2 + 1 + 2 + 1]
+    assert all(len(t) <= 4096 for t in texts)
+
+
+def test_oversize_merge_is_sent_as_separate_messages():
+    bot = FakeBot()
+    sender = _sender(bot, window=0.2)
+    _send_concurrently(sender, [(1, "a" * 3000), (1, "b" * 3000)])
+    assert sorted(len(t) for _, t, _ in bot.sent) == [3000, 3000]
+
+
+def test_token_bucket_limits_the_send_rate():
+    bot = FakeBot()
+    sender = _sender(bot, rate=20.0, window=0)
+    # 桶初始是满的：前 rate 条立即取得令牌，之后约每 1/rate 秒一条
+    start = time.monotonic()
+    for _ in range(20):
+        sender._acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(5):
+        sender._acquire()
+    assert time.monotonic() - start >= 5 / 20.0 * 0.9
+
+
+def test_token_bucket_refills_while_idle():
+    sender = _sender(FakeBot(), rate=20.0)
+    for _ in range(20):
+        sender._acquire()
+    time.sleep(0.1)
+    start = time.monotonic()
+    sender._acquire()
+    sender._acquire()
+    assert time.monotonic() - start < 0.03